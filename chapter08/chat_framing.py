@@ -0,0 +1,47 @@
+"""Wire format of the TCP chat, shared by tcp_chat.py and tcp_chat_loadtest.py.
+
+A frame is the size of its payload as a big-endian UInt32, followed by the payload,
+"username||message" as UTF-8. No Qt is needed to speak it."""
+import struct
+
+PORT = 7777
+DELIMITER = "||"  # between the username and the message
+FRAME_HEADER = struct.Struct(">I")  # payload size, big-endian like QDataStream
+MAX_FRAME_SIZE = 1024 * 1024
+
+
+def encode_frame(raw_message: str) -> bytes:
+    """A message as sent over the wire: its size, then the message as UTF-8."""
+    payload = raw_message.encode("utf-8")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Splits the byte stream of one connection into messages.
+
+    TCP delivers a stream, not the frames that were written, so a read can end in
+    the middle of a frame or hold several of them. Bytes are kept until their frame
+    is complete, and every complete frame is decoded at once."""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[str]:
+        """Add received bytes and return the messages completed by them. Raises
+        ValueError for a frame larger than `MAX_FRAME_SIZE`, the stream can't be
+        trusted after that."""
+        self.buffer += data
+        messages = []
+        start = 0
+        while len(self.buffer) - start >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(self.buffer, start)
+            if size > MAX_FRAME_SIZE:
+                raise ValueError(f"frame of {size} bytes exceeds {MAX_FRAME_SIZE}")
+            end = start + FRAME_HEADER.size + size
+            if end > len(self.buffer):
+                break
+            payload = self.buffer[start + FRAME_HEADER.size : end]
+            messages.append(payload.decode("utf-8", "replace"))
+            start = end
+        del self.buffer[:start]
+        return messages
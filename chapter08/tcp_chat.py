@@ -1,8 +1,9 @@
+from collections import deque
 from typing import AbstractSet, Optional, Union
 from PySide6.QtGui import QAction
 from PySide6.QtCore import (
     QByteArray,
-    QDataStream,
+    QCoreApplication,
     QDir,
     QObject,
     Qt,
@@ -28,19 +29,72 @@ from PySide6.QtNetwork import (
     QUdpSocket,
 )
 
+from chat_framing import DELIMITER, PORT, FrameDecoder, encode_frame
+
+
+HIGH_WATER = 64 * 1024  # bytes left with a socket before it must write some
+MAX_QUEUED = 4 * 1024 * 1024  # bytes a hub client may fall behind before it's dropped
+
+
+class Peer:
+    """An accepted connection: its decoder and, in a hub, the frames waiting to be
+    written to it."""
+
+    def __init__(self, socket: QTcpSocket) -> None:
+        self.socket = socket
+        self.decoder = FrameDecoder()
+        self.outgoing: deque[bytes] = deque()
+        self.queued = 0  # bytes in `outgoing`
+        # bound to this peer, as looking up the sender of every signal is slow
+        socket.bytesWritten.connect(self.on_bytes_written)
+
+    def send(self, frame: bytes):
+        """Queue `frame` and write as much as the socket has room for. A client more
+        than `MAX_QUEUED` bytes behind is dropped."""
+        self.outgoing.append(frame)
+        self.queued += len(frame)
+        if self.queued > MAX_QUEUED:
+            self.socket.abort()  # emits disconnected, which forgets the client
+        else:
+            self.flush()
+
+    def on_bytes_written(self, written: int):
+        if self.outgoing:
+            self.flush()
+
+    def flush(self):
+        """Hand queued frames to the socket in a single write, as long as it has
+        less than `HIGH_WATER` bytes to write. The rest waits for `bytesWritten`."""
+        room = HIGH_WATER - self.socket.bytesToWrite()
+        frames = []
+        while self.outgoing and room > 0:
+            frame = self.outgoing.popleft()
+            self.queued -= len(frame)
+            room -= len(frame)
+            frames.append(frame)
+        if frames:
+            self.socket.write(b"".join(frames))
+
 
 class TcpChatInterface(QObject):
-    """Facilitates communication over TCP."""
+    """Facilitates communication over TCP.
 
-    port = 7777
-    delimiter = "||"
+    As a hub, every message received is passed on to all other connected clients,
+    and messages sent go to all of them. Each client has its own queue, which is
+    only handed to the socket while less than `HIGH_WATER` bytes wait to be written,
+    so a slow client can't make the hub buffer without bound. A client more than
+    `MAX_QUEUED` bytes behind is dropped."""
+
+    port = PORT
+    delimiter = DELIMITER
     received: Union[Signal, SignalInstance] = Signal(str, str)
     error: Union[Signal, SignalInstance] = Signal(str)
 
-    def __init__(self, username: str, recipient: str) -> None:
+    def __init__(self, username: str, recipient: str, hub: bool = False) -> None:
         super().__init__()
         self.username = username
         self.recipient = recipient
+        self.hub = hub
 
         # ---------------------
         # initialize TCP Server
@@ -50,7 +104,7 @@ class TcpChatInterface(QObject):
         self.listener.listen(QHostAddress.Any, self.port)
         self.listener.acceptError.connect(self.on_error)
         self.listener.newConnection.connect(self.on_connection)
-        self.connections: list[QTcpSocket] = []
+        self.connections: dict[QTcpSocket, Peer] = {}
 
         # ---------------------
         # initialize TCP client
@@ -58,6 +112,10 @@ class TcpChatInterface(QObject):
 
         self.client_socket = QTcpSocket()
         self.client_socket.errorOccurred.connect(self.on_error)
+        # a hub sends the messages of the other clients back on this connection
+        self.client_decoder = FrameDecoder()
+        self.client_socket.readyRead.connect(self.process_datastream)
+        self.client_socket.disconnected.connect(self.on_client_disconnected)
 
     def on_error(self, socket_error: QAbstractSocket.SocketError):
         # PyQt hack:
@@ -73,29 +131,62 @@ class TcpChatInterface(QObject):
         """Handle incoming connections."""
         connection = self.listener.nextPendingConnection()
         connection.readyRead.connect(self.process_datastream)
-        self.connections.append(connection)
+        connection.disconnected.connect(self.on_disconnected)
+        if self.hub:
+            # chat messages are small, don't hold them back to fill a packet
+            connection.setSocketOption(QAbstractSocket.LowDelayOption, 1)
+        self.connections[connection] = Peer(connection)
+
+    def on_disconnected(self):
+        """Forget a connection that was closed by either side."""
+        socket = self.sender()
+        self.connections.pop(socket, None)
+        socket.deleteLater()
+
+    def on_client_disconnected(self):
+        self.client_decoder = FrameDecoder()  # a partial frame won't be completed
 
     def process_datastream(self):
-        """Handle incoming data."""
-        for socket in self.connections:
-            self.datastream = QDataStream(socket)
-            if not socket.bytesAvailable():
-                continue
-            message_len = self.datastream.readUInt32()
-            raw_message = self.datastream.readQString()
-            if raw_message and self.delimiter in raw_message:
+        """Handle incoming data on the connection that has some."""
+        socket = self.sender()
+        if socket is self.client_socket:
+            decoder = self.client_decoder
+        elif socket in self.connections:
+            decoder = self.connections[socket].decoder
+        else:
+            return
+        try:
+            raw_messages = decoder.feed(socket.readAll().data())
+        except ValueError as error:
+            peer = socket.peerAddress().toString()
+            self.error.emit(f"Dropped the connection from {peer}: {error}")
+            socket.abort()
+            return
+        for raw_message in raw_messages:
+            if self.delimiter in raw_message:
                 username, message = raw_message.split(self.delimiter, 1)
                 self.received.emit(username, message)
+                if self.hub and socket is not self.client_socket:
+                    self.broadcast(encode_frame(raw_message), source=socket)
+
+    def broadcast(self, frame: bytes, source: Optional[QTcpSocket] = None):
+        """Queue `frame` for every client but the one it came from."""
+        for socket, peer in list(self.connections.items()):
+            if socket is not source:
+                peer.send(frame)
 
     def send_message(self, message: str):
         """Establishes connection to the server and sends data stream."""
         raw_message = f"{self.username}{self.delimiter}{message}"
+        if self.hub:
+            self.broadcast(encode_frame(raw_message))
+            self.received.emit(self.username, message)
+            return
         socket_state = self.client_socket.state()
         if socket_state != QAbstractSocket.ConnectedState:
             self.client_socket.connectToHost(self.recipient, self.port)
-        self.datastream = QDataStream(self.client_socket)
-        self.datastream.writeUInt32(len(raw_message))
-        self.datastream.writeQString(raw_message)
+        # written once connected, if the connection is still being set up
+        self.client_socket.write(encode_frame(raw_message))
 
         # emit received signal for local display in the text box.
         self.received.emit(self.username, message)
@@ -135,12 +226,16 @@ class MainWindow(QMainWindow):
         self.cw = ChatWindow(self)
         self.setCentralWidget(self.cw)
         username = QDir.home().dirName()
-        recipient, _ = QInputDialog.getText(
-            self, "Recipient", "Specify the IP or hostname of the remote host."
+        recipient, ok = QInputDialog.getText(
+            self,
+            "Recipient",
+            "Specify the IP or hostname of the remote host or hub.\n"
+            "Leave it empty to run a hub for others to connect to.",
         )
-        if not recipient:
+        if not ok:
             sys.exit()
-        self.interface = TcpChatInterface(username, recipient=recipient)
+        hub = not recipient
+        self.interface = TcpChatInterface(username, recipient=recipient, hub=hub)
         self.cw.submitted.connect(self.interface.send_message)
         self.interface.received.connect(self.cw.write_message)
         self.interface.error.connect(lambda x: QMessageBox.critical(self, "Error", x))
@@ -149,6 +244,14 @@ class MainWindow(QMainWindow):
 if __name__ == "__main__":
     import sys
 
+    if "--hub" in sys.argv:
+        # headless hub, e.g. for tcp_chat_loadtest.py
+        app = QCoreApplication(sys.argv)
+        hub = TcpChatInterface(QDir.home().dirName(), "", hub=True)
+        if not hub.listener.isListening():
+            sys.exit(f"cannot listen on port {hub.port}")
+        sys.exit(app.exec())
+
     app = QApplication(sys.argv)
     mw = MainWindow(None, windowTitle="TCP-Chat")
     mw.show()
@@ -0,0 +1,193 @@
+"""Load test for the hub mode of tcp_chat.py on localhost.
+
+A headless hub is started, --clients clients connect to it, and random clients send
+--rate messages per second for --duration seconds. The hub passes every message on
+to all other clients, which time its arrival:
+
+    python tcp_chat_loadtest.py --clients 1000 --rate 50 --duration 10
+
+Messages/s counts the messages the clients received, so it is about --rate times
+the number of clients. All clients share one asyncio loop in this process, which
+can become the bottleneck before the hub does; the CPU use of both is reported.
+Use --host to test a hub that is already running instead.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from chat_framing import DELIMITER, FRAME_HEADER, PORT, encode_frame
+
+
+class Client:
+    """One chat connection, recording the latency of every message it receives."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.latencies: list[int] = []  # ns
+
+    async def send(self, sequence: int) -> None:
+        # the send time travels in the message, every client shares the clock
+        message = f"loadtest{DELIMITER}{time.perf_counter_ns()}"
+        self.writer.write(encode_frame(f"{message} {sequence}"))
+        await self.writer.drain()
+
+    async def receive(self) -> None:
+        while True:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+            (size,) = FRAME_HEADER.unpack(header)
+            payload = await self.reader.readexactly(size)
+            arrived = time.perf_counter_ns()
+            _, _, message = payload.decode("utf-8").partition(DELIMITER)
+            self.latencies.append(arrived - int(message.split()[0]))
+
+
+def percentile(ordered: list[int], fraction: float) -> int:
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def raise_file_limit(needed: int) -> None:
+    """Allow this process, and the hub it starts, a file descriptor per client."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+async def wait_for_hub(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+
+
+async def connect(host: str, port: int, count: int) -> list[Client]:
+    """Connect `count` clients, a few at a time so the listen backlog keeps up."""
+    limit = asyncio.Semaphore(50)
+
+    async def one() -> Client:
+        async with limit:
+            return Client(*await asyncio.open_connection(host, port))
+
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    await wait_for_hub(args.host, args.port, timeout=10)
+    clients = await connect(args.host, args.port, args.clients)
+    receivers = [asyncio.create_task(client.receive()) for client in clients]
+    await asyncio.sleep(0.5)  # let the hub register the last connections
+
+    started = time.perf_counter()
+    sent = 0
+    rng = random.Random(10)
+    while time.perf_counter() - started < args.duration:
+        await rng.choice(clients).send(sent)
+        sent += 1
+        # pace by the schedule, not by the time each send took
+        await asyncio.sleep(max(started + sent / args.rate - time.perf_counter(), 0))
+
+    expected = sent * (len(clients) - 1)
+    deadline = time.perf_counter() + args.drain_timeout
+    while time.perf_counter() < deadline:
+        if sum(len(client.latencies) for client in clients) >= expected:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    for receiver in receivers:
+        receiver.cancel()
+    for client in clients:
+        client.writer.close()
+    latencies = sorted(ns for client in clients for ns in client.latencies)
+    received = len(latencies)
+    if not latencies:
+        latencies = [0]
+    return {
+        "clients": len(clients),
+        "sent": sent,
+        "received": received,
+        "expected": expected,
+        "messages_per_second": received / elapsed,
+        "p50_ms": percentile(latencies, 0.5) / 1e6,
+        "p99_ms": percentile(latencies, 0.99) / 1e6,
+        "max_ms": latencies[-1] / 1e6,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--rate", type=float, default=50, help="messages sent per second, in total"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=10,
+        help="seconds to wait for the last messages to arrive",
+    )
+    parser.add_argument("--host", help="hub to test, default: start one")
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    raise_file_limit(args.clients + 100)
+    start = time.perf_counter()
+    hub = None
+    if args.host is None:
+        args.host = "127.0.0.1"
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tcp_chat.py")
+        hub = subprocess.Popen([sys.executable, script, "--hub"])
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if hub is not None:
+            hub.terminate()
+            hub.wait()
+    hub_usage = resource.getrusage(resource.RUSAGE_CHILDREN)  # the hub is the only one
+    elapsed = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print(
+        f"{result['clients']} clients, {result['sent']} messages sent, "
+        f"{result['received']}/{result['expected']} received"
+    )
+    print(f"{result['messages_per_second']:.0f} messages/s received")
+    scheduled = int(args.rate * args.duration)
+    if result["sent"] < scheduled * 0.95:
+        # the latencies then include the time spent waiting in this process
+        print(
+            f"only {result['sent']} of {scheduled} messages could be sent on "
+            "schedule, the clients are the bottleneck"
+        )
+    print(
+        f"latency p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+        f"max {result['max_ms']:.1f} ms"
+    )
+    # busy cores on average over the whole run, including connecting
+    print(f"CPU: clients {(usage.ru_utime + usage.ru_stime) / elapsed:.2f}", end="")
+    if hub is not None:
+        print(f", hub {(hub_usage.ru_utime + hub_usage.ru_stime) / elapsed:.2f}")
+    else:
+        print()
+    return 0 if result["received"] >= result["expected"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Content search for the file searcher, run in worker processes.
+
+The functions here need no Qt. The spawned workers still import the main script,
+so `SlowSearcher` starts them once and keeps them for all content searches."""
+import mmap
+import os
+import re
+from typing import Union
+
+SNIFF_SIZE = 8192  # bytes looked at to tell binary files from text
+MMAP_THRESHOLD = 1024 * 1024  # map files this large instead of reading them
+MAX_LINE = 500  # characters of a matching line that are reported
+
+
+def is_binary(head: bytes) -> bool:
+    """Treat a file as binary if its first block has a NUL byte, like grep does."""
+    return b"\0" in head
+
+
+def case_insensitive(needle: bytes) -> "re.Pattern[bytes]":
+    """A pattern that finds the UTF-8 `needle` in any case.
+
+    re.IGNORECASE folds only ASCII in bytes, and the bytes of other letters differ
+    between their cases, so each of those becomes the set of its case variants."""
+    if needle.isascii():
+        return re.compile(re.escape(needle), re.IGNORECASE)
+    parts = []
+    for char in needle.decode("utf-8"):
+        variants = sorted({char, char.lower(), char.upper()})
+        escaped = [re.escape(variant.encode("utf-8")) for variant in variants]
+        if len(escaped) > 1:
+            parts.append(b"(?:" + b"|".join(escaped) + b")")
+        else:
+            parts.append(escaped[0])
+    return re.compile(b"".join(parts))
+
+
+def grep_file(
+    path: str, needle: Union[bytes, "re.Pattern[bytes]"], first_match_only: bool
+) -> list[str]:
+    """The lines of `path` that contain `needle` as "path:line: text", or just the
+    path once if `first_match_only` is set. `needle` is a literal or, to ignore the
+    case, a pattern from `case_insensitive`. Binary files never match, and neither
+    does an empty `needle`."""
+    if not needle:
+        return []
+    with open(path, "rb") as fh:
+        if is_binary(fh.read(SNIFF_SIZE)):
+            return []
+        size = os.fstat(fh.fileno()).st_size
+        if not size:
+            return []
+        data: Union[bytes, mmap.mmap]
+        if size >= MMAP_THRESHOLD:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            fh.seek(0)
+            data = fh.read()
+
+    def find(start: int) -> int:
+        if isinstance(needle, bytes):
+            return data.find(needle, start)
+        match = needle.search(data, start)
+        return match.start() if match else -1
+
+    try:
+        position = find(0)
+        if position < 0:
+            return []
+        if first_match_only:
+            return [path]
+        matches = []
+        line_number, counted = 1, 0
+        while position >= 0:
+            line_start = data.rfind(b"\n", 0, position) + 1
+            line_end = data.find(b"\n", position)
+            if line_end < 0:
+                line_end = len(data)
+            line_number += data[counted:line_start].count(b"\n")
+            counted = line_start
+            line = data[line_start:line_end][: MAX_LINE * 4]
+            text = line.decode("utf-8", "replace").rstrip("\r")[:MAX_LINE]
+            matches.append(f"{path}:{line_number}: {text}")
+            position = find(max(line_end, position + 1))
+        return matches
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def grep_files(
+    paths: list[str], needle: bytes, first_match_only: bool, ignore_case: bool = False
+) -> list[str]:
+    """Search a batch of files. Files that cannot be read are skipped."""
+    pattern = case_insensitive(needle) if ignore_case and needle else needle
+    matches = []
+    for path in paths:
+        try:
+            matches += grep_file(path, pattern, first_match_only)
+        except (OSError, ValueError):
+            continue
+    return matches
@@ -1,9 +1,26 @@
-from typing import Callable, Optional, Union
+import fnmatch
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Callable, Iterable, Optional, Tuple, Union
 from PyQt6.QtGui import QAction
 from PyQt6.QtCore import (
-    QDir,
+    QAbstractListModel,
+    QModelIndex,
     QObject,
+    QRunnable,
     QThread,
+    QThreadPool,
+    QTimer,
     Qt,
     pyqtBoundSignal,
     pyqtSignal,
@@ -11,57 +28,734 @@ from PyQt6.QtCore import (
 )
 from PyQt6.QtWidgets import (
     QApplication,
+    QCheckBox,
+    QComboBox,
+    QFormLayout,
+    QLabel,
     QLineEdit,
-    QListWidget,
+    QListView,
     QMainWindow,
-    QMessageBox,
+    QSpinBox,
     QVBoxLayout,
     QWidget,
 )
 
+from content_search import grep_files
+from search_index import FileIndex, IndexUpdater, IndexWatcher, find_lines
+
 SIGNAL = Union[pyqtSignal, pyqtBoundSignal]
 SLOT = Union[Callable[..., None], pyqtBoundSignal]
 
+TYPING_DELAY = 250  # ms without a keystroke before a search-as-you-type starts
+MATCH_MODES = ("substring", "glob", "regex")
+REGEX_SPECIAL = frozenset(".^$*+?{}[]()|\\")
+
+
+@dataclass
+class SearchOptions:
+    """Settings of the `SlowSearcher` for the next search."""
+
+    roots: Tuple[str, ...] = (R"C:\Steam",)  # none of them inside another
+    match_mode: str = "substring"  # or "glob" or "regex", see `MATCH_MODES`
+    ignore_case: bool = False
+    basename_only: bool = False  # match the term against names, not whole paths
+    threads: int = 8  # directories scanned at once, scandir mostly waits for the disk
+    excludes: Tuple[str, ...] = ()  # glob patterns of names to skip, with their content
+    max_depth: int = -1  # levels of subdirectories to descend into, -1 for all
+    batch_size: int = 1000  # matches collected before they are sent to the GUI
+    batch_interval: float = 0.1  # seconds before a partial batch is sent anyway
+    status_interval: float = 0.25  # minimum seconds between `dir_changed` signals
+    use_index: bool = False  # search a `FileIndex` instead of the disk once it is built
+    # each set of roots gets an index file of its own, named after this one
+    index_path: str = os.path.join(os.path.expanduser("~"), ".file_searcher.sqlite")
+    index_max_age: float = 3600.0  # seconds after which indexed results are stale
+    index_refresh_interval: float = 60.0  # minimum seconds between index refreshes
+    watch_index: bool = True  # keep the index current with an `IndexWatcher`
+    content: bool = False  # search the text of the files instead of their paths
+    first_match_only: bool = False  # list the matching files, not every line
+    grep_processes: int = os.cpu_count() or 1
+    grep_batch_size: int = 256  # files per task sent to a content search process
+    refine_limit: int = 1_000_000  # matches kept to refine, more are searched again
+    stats_path: str = ""  # JSON Lines file the `SearchStats` of each search go to
+
+
+def compile_excludes(patterns: Tuple[str, ...]) -> Optional[Callable[[str], object]]:
+    """A single `match` function for all glob `patterns`, or None without any."""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns)).match
+
+
+@dataclass
+class SearchStats:
+    """Throughput of a search, emitted with `SlowSearcher.stats_changed`.
+
+    The times are summed over the scan threads, so together they can exceed
+    `elapsed`. `scandir_time` is spent listing directories, which is mostly system
+    calls, `match_time` on the excludes, the term and the entry types, and
+    `signal_time` on emitting to the GUI. A slow search with little `match_time`
+    waits for the disk."""
+
+    term: str = ""
+    elapsed: float = 0.0
+    directories: int = 0
+    entries: int = 0
+    matches: int = 0
+    scandir_time: float = 0.0
+    match_time: float = 0.0
+    signal_time: float = 0.0
+    max_depth: int = 0  # levels below the root of the deepest directory scanned
+    deepest_path: str = ""
+
+    def rate(self, count: int) -> float:
+        return count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                **asdict(self),
+                "directories_per_second": self.rate(self.directories),
+                "entries_per_second": self.rate(self.entries),
+                "matches_per_second": self.rate(self.matches),
+            }
+        )
+
+    def __str__(self) -> str:
+        summary = (
+            f"{self.rate(self.directories):.0f} dirs/s, "
+            f"{self.rate(self.entries):.0f} entries/s, "
+            f"{self.rate(self.matches):.0f} matches/s"
+        )
+        busy = self.scandir_time + self.match_time + self.signal_time
+        if busy:
+            summary += (
+                f", time in scandir {self.scandir_time / busy:.0%}, "
+                f"matching {self.match_time / busy:.0%}, "
+                f"signals {self.signal_time / busy:.0%}"
+            )
+        return summary + f", depth {self.max_depth}"
+
+
+def required_literal(term: str, match_mode: str) -> str:
+    """A string that every match of `term` contains, or "" if none is known.
+
+    For a glob this is its longest run without wildcards, unless it has a set,
+    whose end fnmatch finds by rules of its own. For a regex it is the literal text
+    it starts with, unless there is an alternative to it."""
+    if match_mode == "substring":
+        return term
+    if match_mode == "glob":
+        if "[" in term:
+            return ""
+        return max(re.split(r"[*?]", term), key=len)
+    if "|" in term:
+        return ""
+    literal = []
+    position = 1 if term.startswith("^") else 0
+    while position < len(term):
+        char = term[position]
+        if char == "\\" and position + 1 < len(term):
+            char = term[position + 1]
+            if char.isalnum():  # a class like \d or an anchor like \b
+                break
+            position += 1
+        elif char in REGEX_SPECIAL:
+            if char in "*?{" and literal:
+                literal.pop()  # the quantifier makes the last character optional
+            break
+        literal.append(char)
+        position += 1
+    return "".join(literal)
+
+
+def compile_matcher(term: str, options: SearchOptions) -> Callable[[str], bool]:
+    """A test for names or paths that match `term`, built once per search.
+
+    Glob and regex patterns are compiled here, and the literal that every match
+    contains is looked for with `in` first, so most names never reach the regex.
+    Raises `re.error` for an invalid regex."""
+    ignore_case = options.ignore_case
+    literal = required_literal(term, options.match_mode)
+    if ignore_case:
+        # str.lower() folds fewer characters than re.IGNORECASE, except for ASCII
+        literal = literal.lower() if literal.isascii() else ""
+    if options.match_mode == "substring" and not ignore_case:
+        return lambda text: term in text
+    flags = re.IGNORECASE if ignore_case else 0
+    if options.match_mode == "glob":
+        search = re.compile(fnmatch.translate(term), flags).match
+    elif options.match_mode == "regex":
+        search = re.compile(term, flags).search
+    else:
+        search = re.compile(re.escape(term), flags).search
+    if not literal:
+        return lambda text: search(text) is not None
+    if ignore_case:
+        return lambda text: literal in text.lower() and search(text) is not None
+    return lambda text: literal in text and search(text) is not None
+
+
+def split_roots(text: str) -> Tuple[str, ...]:
+    """The directories in a list separated by `os.pathsep`, without those that are
+    inside another one, which would be searched twice."""
+    roots = sorted({os.path.normpath(part) for part in text.split(os.pathsep) if part})
+    kept: list[str] = []
+    for root in roots:
+        if not any(root.startswith(os.path.join(other, "")) for other in kept):
+            kept.append(root)
+    return tuple(kept)
+
+
+def root_of(path: str, roots: Tuple[str, ...]) -> str:
+    """The root that `path` was found below."""
+    for root in roots:
+        if path == root or path.startswith(os.path.join(root, "")):
+            return root
+    return os.path.dirname(path)
+
+
+def filter_paths(paths: list[str], options: SearchOptions) -> list[str]:
+    """Apply the excludes and the maximum depth to paths below the roots, as
+    `TreeScan` does during the walk."""
+    exclude = compile_excludes(options.excludes)
+    if not exclude and options.max_depth < 0:
+        return paths
+    kept = []
+    for path in paths:
+        parts = os.path.relpath(path, root_of(path, options.roots)).split(os.sep)
+        if 0 <= options.max_depth < len(parts) - 1:
+            continue
+        if exclude and any(exclude(part) for part in parts):
+            continue
+        kept.append(path)
+    return kept
+
+
+def read_directory(path: str) -> list[os.DirEntry]:
+    """All entries of `path`, read before any is matched, so the time taken by the
+    system calls can be told from the time spent on matching."""
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except OSError:
+        return []  # e.g. no permission, skipped like QDir does
+
+
+class TreeScan:
+    """One search through the trees below `options.roots`, shared by several
+    `ScanWorker`s.
+
+    Directories wait in a queue instead of on the call stack, so the depth of the
+    tree does not matter. Every scanned directory is reported on `results` as a
+    `(directory, matches)` tuple, and `None` follows the last one. `entry.is_dir()`
+    is answered from the directory listing on most platforms, so no entry is
+    stat'ed. Only the entry names are matched if `options.basename_only` is set. In
+    content mode the matches are all regular files, whatever their name. Once
+    `cancelled` is set, the remaining directories are reported without being
+    listed, so the workers wind down within one directory entry."""
+
+    def __init__(
+        self,
+        term: str,
+        options: SearchOptions,
+        cancelled: threading.Event,
+        stats: SearchStats,
+    ) -> None:
+        # in content mode the term is a literal to look for in the files
+        self.match = None if options.content else compile_matcher(term, options)
+        self.options = options
+        self.cancelled = cancelled
+        self.stats = stats  # updated with `lock` held
+        self.exclude = compile_excludes(options.excludes)
+        self.directories: queue.SimpleQueue = queue.SimpleQueue()
+        self.results: queue.SimpleQueue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.pending = len(options.roots)  # directories queued or being scanned
+        for root in options.roots:
+            self.directories.put((root, 0))
+        if not options.roots:
+            self.finish()
+
+    def work(self) -> None:
+        """Scan directories until the whole tree is done."""
+        while True:
+            item = self.directories.get()
+            if item is None:
+                return
+            self.scan(*item)
+
+    def scan(self, path: str, depth: int) -> None:
+        entries: list[os.DirEntry] = []
+        matches: list[str] = []
+        subdirectories: list[str] = []
+        started = listed = matched = time.perf_counter()
+        if not self.cancelled.is_set():
+            descend = self.options.max_depth < 0 or depth < self.options.max_depth
+            entries = read_directory(path)
+            listed = time.perf_counter()
+            matches, subdirectories = self.sort_entries(entries, descend)
+            matched = time.perf_counter()
+        with self.lock:
+            self.pending += len(subdirectories) - 1
+            done = not self.pending
+            stats = self.stats
+            stats.directories += 1
+            stats.entries += len(entries)
+            stats.scandir_time += listed - started
+            stats.match_time += matched - listed
+            if depth > stats.max_depth:
+                stats.max_depth, stats.deepest_path = depth, path
+        for subdirectory in subdirectories:
+            self.directories.put((subdirectory, depth + 1))
+        self.results.put((path, matches))
+        if done:
+            self.finish()
+
+    def finish(self) -> None:
+        """Stop the workers and tell the reader of `results` that the walk is done."""
+        for _ in range(self.options.threads):
+            self.directories.put(None)
+        self.results.put(None)
+
+    def sort_entries(
+        self, entries: list[os.DirEntry], descend: bool
+    ) -> Tuple[list[str], list[str]]:
+        """The matches among `entries` and the subdirectories to scan next."""
+        match, exclude, content = self.match, self.exclude, self.options.content
+        basename_only = self.options.basename_only
+        is_cancelled = self.cancelled.is_set
+        matches = []
+        subdirectories = []
+        for entry in entries:
+            if is_cancelled():
+                return [], []
+            if exclude and exclude(entry.name):
+                continue
+            if not content and match(entry.name if basename_only else entry.path):
+                matches.append(entry.path)
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = content and entry.is_file(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_file:
+                matches.append(entry.path)
+            elif is_dir and descend:
+                subdirectories.append(entry.path)
+        return matches, subdirectories
+
+
+class ScanWorker(QRunnable):
+    def __init__(self, scan: TreeScan) -> None:
+        super().__init__()
+        self.scan = scan
+        self.setAutoDelete(True)
+
+    def run(self) -> None:
+        self.scan.work()
+
 
 class SlowSearcher(QObject):
-    """search engine with random delays"""
+    """search engine with random delays
+
+    Every search has an id, which comes back with its matches, so the GUI can drop
+    those of a search it has given up on. `finished` is not emitted for cancelled
+    searches."""
 
-    match_found: SIGNAL = pyqtSignal(str)
+    matches_found: SIGNAL = pyqtSignal(int, list)  # search id, a batch of paths
     dir_changed: SIGNAL = pyqtSignal(str)
-    finished: SIGNAL = pyqtSignal()
+    index_stale: SIGNAL = pyqtSignal(float)  # age of the index in seconds
+    index_ready: SIGNAL = pyqtSignal(object)  # FileIndex that can be watched
+    finished: SIGNAL = pyqtSignal(int)  # search id
+    stats_changed: SIGNAL = pyqtSignal(object)  # SearchStats of the running search
+    pattern_error: SIGNAL = pyqtSignal(int, str)  # search id, message
 
     def __init__(self, parent: Optional[QObject] = None) -> None:
         super().__init__(parent=parent)
-        self.term = None
-
-    def set_term(self, term: str):
-        self.term = term
-
-    # @pyqtSlot()
-    def do_search(self):
-        root = R"C:\Steam"
-        self._search(self.term, root)
-        self.finished.emit()
-
-    def _search(self, term: str, path: str):
-        self.dir_changed.emit(path)
-        directory = QDir(path)
-        directory.setFilter(
-            directory.filter() | QDir.Filter.NoDotAndDotDot | QDir.Filter.NoSymLinks
+        self.options = SearchOptions()
+        self.pool = QThreadPool()
+        self.index: Optional[FileIndex] = None
+        self.updater: Optional[IndexUpdater] = None
+        self.lock = threading.Lock()
+        self.latest = 0  # id of the last search requested
+        self.cancelled: Optional[threading.Event] = None  # of the running search
+        # matches of the running search joined per batch, None if not kept
+        self.delivered: Optional[list[str]] = []
+        self.stats = SearchStats()  # of the running search
+        self.started = 0.0
+        # term, options and newline separated matches of the last complete search
+        self.previous: Optional[Tuple[str, SearchOptions, str]] = None
+        self.executor: Optional[ProcessPoolExecutor] = None  # for content searches
+
+    def cancel(self, search_id: int) -> None:
+        """Stop the running search and skip any queued one before `search_id`.
+
+        Called directly from the GUI thread, since the thread of the searcher is
+        busy for as long as a search runs."""
+        with self.lock:
+            self.latest = search_id
+            if self.cancelled is not None:
+                self.cancelled.set()
+
+    def set_roots(self, roots: str):
+        self.options.roots = split_roots(roots)
+
+    def set_match_mode(self, match_mode: str):
+        self.options.match_mode = match_mode
+
+    def set_ignore_case(self, ignore_case: bool):
+        self.options.ignore_case = ignore_case
+
+    def set_basename_only(self, basename_only: bool):
+        self.options.basename_only = basename_only
+
+    def set_excludes(self, patterns: str):
+        self.options.excludes = tuple(patterns.split())
+
+    def set_max_depth(self, depth: int):
+        self.options.max_depth = depth
+
+    def set_use_index(self, use_index: bool):
+        self.options.use_index = use_index
+
+    def set_index_max_age(self, minutes: int):
+        self.options.index_max_age = minutes * 60.0
+
+    def set_content(self, content: bool):
+        self.options.content = content
+
+    def set_first_match_only(self, first_match_only: bool):
+        self.options.first_match_only = first_match_only
+
+    def set_stats_path(self, path: str):
+        self.options.stats_path = path
+
+    @pyqtSlot(int, str, bool)
+    def do_search(self, search_id: int, term: str, refine: bool = False):
+        """Run search `search_id`, unless a later one was requested meanwhile.
+
+        With `refine`, a substring that contains the one of the previous search is
+        looked up in its matches, instead of on the disk. An invalid regex is
+        reported with `pattern_error`."""
+        with self.lock:
+            if search_id != self.latest:
+                return
+            cancelled = self.cancelled = threading.Event()
+        if self.options.content and not term:
+            self.pattern_error.emit(search_id, "searching file contents needs a term")
+            return
+        try:
+            if not self.options.content:
+                compile_matcher(term, self.options)
+        except re.error as error:
+            self.pattern_error.emit(search_id, str(error))
+            return
+        previous, self.previous = self.previous, None
+        self.delivered = []
+        self.stats = SearchStats(term)
+        self.started = time.monotonic()
+        if (
+            refine
+            and self.options.match_mode == "substring"
+            and previous is not None
+            and previous[0] in term
+            and previous[1] == self.options
+        ):
+            self._refine(search_id, term, previous[2])
+        elif self.options.content:
+            self._grep(search_id, term, cancelled)
+        elif not (self.options.use_index and self._search_index(search_id, term)):
+            self._search(search_id, term, cancelled)
+        delivered, self.delivered = self.delivered, []
+        if cancelled.is_set():
+            return
+        if not self.options.content and delivered is not None:
+            self.previous = (term, replace(self.options), "".join(delivered))
+        self._report_stats()
+        if self.options.stats_path:
+            try:
+                with open(self.options.stats_path, "a", encoding="utf-8") as fh:
+                    fh.write(self.stats.to_json() + "\n")
+            except OSError as error:
+                print(f"cannot log search stats: {error}", file=sys.stderr)
+        self.finished.emit(search_id)
+
+    def _report_stats(self) -> None:
+        self.stats.elapsed = time.monotonic() - self.started
+        self.stats_changed.emit(replace(self.stats))
+
+    def _emit(self, signal: SIGNAL, *args) -> None:
+        """Emit `signal`, counting the time it takes as `signal_time`."""
+        started = time.perf_counter()
+        signal.emit(*args)
+        self.stats.signal_time += time.perf_counter() - started
+
+    def _send(self, search_id: int, batch: list[str]) -> None:
+        self._emit(self.matches_found, search_id, batch)
+        self.stats.matches += len(batch)
+        if self.delivered is None:
+            return
+        if self.stats.matches > self.options.refine_limit or any(
+            "\n" in path for path in batch
+        ):
+            # too many to keep, or a path that can't be told apart once joined, so
+            # the next search goes to the disk again
+            self.delivered = None
+        else:
+            self.delivered.append("".join(f"{path}\n" for path in batch))
+
+    def _refine(self, search_id: int, term: str, matches: str) -> None:
+        """Search the matches of the previous search, joined by newlines."""
+        refined = find_lines(matches, "" if self.options.ignore_case else term)
+        refined = self._match_paths(term, refined)
+        for start in range(0, len(refined), self.options.batch_size):
+            self._send(search_id, refined[start : start + self.options.batch_size])
+
+    def _match_paths(self, term: str, paths: list[str]) -> list[str]:
+        """Those of `paths`, found with a literal of `term`, that really match."""
+        if self.options.match_mode == "substring" and not (
+            self.options.ignore_case or self.options.basename_only
+        ):
+            return paths
+        match = compile_matcher(term, self.options)
+        if self.options.basename_only:
+            return [path for path in paths if match(os.path.basename(path))]
+        return [path for path in paths if match(path)]
+
+    def _search_index(self, search_id: int, term: str) -> bool:
+        """Answer the search from the index, and have it refreshed in the background
+        if it is older than `index_refresh_interval`. Returns False while the index is
+        built for the first time, the disk is searched meanwhile."""
+        options = self.options
+        roots = options.roots
+        path = FileIndex.path_for(options.index_path, roots)
+        index = self.index
+        if index is None or index.path != path:
+            # the index of the old roots may still be updated or watched, into its
+            # own file
+            index = self.index = FileIndex(path, roots)
+            index.load()
+        updating = (
+            self.updater is not None
+            and self.updater.index is index
+            and self.updater.is_alive()
         )
-        for entry in directory.entryInfoList():
-            entry_path = entry.filePath()
-            if term in entry_path:
-                print(entry_path)
-                self.match_found.emit(entry_path)
-            if entry.isDir():
-                self._search(term, entry_path)
+        if not updating and (
+            not index.ready or index.age > options.index_refresh_interval
+        ):
+            self.updater = IndexUpdater(index)
+            self.updater.start()
+        if not index.ready:
+            return False
+        if options.watch_index:
+            self.index_ready.emit(index)
+
+        # the index finds a literal part of the term at memory speed, only those
+        # paths are matched against the whole pattern
+        literal = required_literal(term, options.match_mode)
+        if options.ignore_case:
+            literal = ""
+        matches = self._match_paths(term, index.search(literal))
+        matches = filter_paths(matches, options)
+        for start in range(0, len(matches), options.batch_size):
+            self._send(search_id, matches[start : start + options.batch_size])
+        if index.age > options.index_max_age:
+            self.index_stale.emit(index.age)
+        return True
+
+    def _search(self, search_id: int, term: str, cancelled: threading.Event):
+        """Fan the directories out to the pool and pass on what it finds, while the
+        workers carry on with the rest of the tree."""
+        scan = TreeScan(term, self.options, cancelled, self.stats)
+        self.pool.setMaxThreadCount(self.options.threads)
+        for _ in range(self.options.threads):
+            self.pool.start(ScanWorker(scan))
+        self._deliver(search_id, scan.results, cancelled)
+        self.pool.waitForDone()
+
+    def _grep(self, search_id: int, term: str, cancelled: threading.Event):
+        """Search the content of every file below the roots in worker processes. The
+        term is always a literal here, the match modes apply to names, but Ignore
+        Case is honoured.
+
+        The walk runs in the pool as usual, and a feeder thread sends the files it
+        finds to the processes in batches of `grep_batch_size`. Their matches come
+        back through the same kind of queue as those of a name search. On
+        cancellation, batches that have not started are dropped, the running ones
+        are waited for."""
+        options = self.options
+        scan = TreeScan(term, options, cancelled, self.stats)
+        self.pool.setMaxThreadCount(options.threads)
+        for _ in range(options.threads):
+            self.pool.start(ScanWorker(scan))
+        if self.executor is None:
+            # Spawned, so the workers don't inherit the Qt threads of this process.
+            # Each of them imports the main script and with it PyQt6, which takes
+            # a while, so they are started once and kept for later searches.
+            self.executor = ProcessPoolExecutor(
+                options.grep_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        executor = self.executor
+        results: queue.SimpleQueue = queue.SimpleQueue()
+        needle = term.encode("utf-8")
+
+        def report(future):
+            if future.cancelled():
+                return
+            try:
+                results.put(("", future.result()))
+            except Exception as error:  # e.g. a worker process died
+                print(f"content search failed: {error}", file=sys.stderr)
+
+        def feed():
+            futures = []
+
+            def submit(files):
+                future = executor.submit(
+                    grep_files,
+                    files,
+                    needle,
+                    options.first_match_only,
+                    options.ignore_case,
+                )
+                future.add_done_callback(report)
+                futures.append(future)
+
+            batch: list[str] = []
+            try:
+                for directory, files in iter(scan.results.get, None):
+                    if cancelled.is_set():
+                        continue  # the walk winds down, nothing more is sent
+                    results.put((directory, []))  # for the status bar
+                    batch += files
+                    while len(batch) >= options.grep_batch_size:
+                        submit(batch[: options.grep_batch_size])
+                        del batch[: options.grep_batch_size]
+                if batch and not cancelled.is_set():
+                    submit(batch)
+            except BrokenProcessPool as error:  # a worker process died
+                print(f"content search failed: {error}", file=sys.stderr)
+                self.executor = None  # started anew for the next search
+            pending = set(futures)
+            while pending:
+                if cancelled.is_set():
+                    for future in pending:
+                        future.cancel()
+                _, pending = wait(pending, timeout=options.batch_interval)
+            results.put(None)
+
+        feeder = threading.Thread(target=feed, name="GrepFeeder", daemon=True)
+        feeder.start()
+        self._deliver(search_id, results, cancelled)
+        feeder.join()
+        self.pool.waitForDone()
+
+    def _deliver(
+        self, search_id: int, results: queue.SimpleQueue, cancelled: threading.Event
+    ) -> None:
+        """Pass the matches on to the GUI in batches, and the current directory only
+        every `status_interval`. A signal per match or directory would flood the
+        GUI thread's event queue on broad terms. After cancellation, `results` is
+        only drained."""
+        batch: list[str] = []
+        last_batch = time.monotonic()
+        last_status = 0.0  # show the first directory right away
+        while True:
+            timeout = None  # nothing to send, wait for the workers
+            if batch:
+                due = last_batch + self.options.batch_interval
+                timeout = max(due - time.monotonic(), 0)
+            try:
+                item = results.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if cancelled.is_set():
+                batch = []
+                continue
+            now = time.monotonic()
+            if item:
+                directory, matches = item
+                batch.extend(matches)
+                if now - last_status >= self.options.status_interval:
+                    self._emit(self.dir_changed, directory)
+                    self._report_stats()
+                    last_status = now
+            if len(batch) >= self.options.batch_size or (
+                batch and now - last_batch >= self.options.batch_interval
+            ):
+                self._send(search_id, batch)
+                batch = []
+                last_batch = now
+        if batch:
+            self._send(search_id, batch)
+
+
+class PathStore:
+    """Append-only list of paths, stored as UTF-8 in one buffer.
+
+    Each path costs its bytes plus an 8 byte offset, instead of a Python string and
+    a list slot. Undecodable file names survive the round trip through
+    "surrogateescape", like in `os.fsencode`."""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.offsets = array("Q", [0])  # path i is data[offsets[i]:offsets[i + 1]]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.data[start:end].decode("utf-8", "surrogateescape")
+
+    def extend(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            self.data += path.encode("utf-8", "surrogateescape")
+            self.offsets.append(len(self.data))
+
+    def clear(self) -> None:
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+
+class ResultsModel(QAbstractListModel):
+    """Read-only list model of the matches, backed by a `PathStore`."""
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self.paths = PathStore()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            # Qt can't hold the lone surrogates of undecodable names
+            return self.paths[index.row()].encode("utf-8", "replace").decode("utf-8")
+        return None
+
+    def append(self, paths: list[str]) -> None:
+        """Add a batch of paths with a single insert notification."""
+        if not paths:
+            return
+        first = len(self.paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(paths) - 1)
+        self.paths.extend(paths)
+        self.endInsertRows()
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self.paths.clear()
+        self.endResetModel()
 
 
 class SearchForm(QWidget):
 
     textChanged = pyqtSignal(str)
     returnPressed = pyqtSignal()
+    termTyped = pyqtSignal()  # typing paused in search-as-you-type mode
 
     def __init__(self, parent: QWidget = None) -> None:
         super().__init__(parent=parent)
@@ -70,18 +764,71 @@ class SearchForm(QWidget):
             textChanged=self.textChanged,
             returnPressed=self.returnPressed,
         )
-        self.results = QListWidget()
+        self.excludes_inp = QLineEdit(placeholderText="e.g. .git node_modules *.tmp")
+        self.max_depth_inp = QSpinBox(
+            minimum=-1, maximum=1000, value=-1, specialValueText="Unlimited"
+        )
+        self.as_you_type_inp = QCheckBox()
+        defaults = SearchOptions()
+        self.roots_inp = QLineEdit(
+            os.pathsep.join(defaults.roots),
+            placeholderText=f"directories separated by {os.pathsep}",
+        )
+        self.match_mode_inp = QComboBox()
+        self.match_mode_inp.addItems(MATCH_MODES)
+        self.match_mode_inp.setCurrentText(defaults.match_mode)
+        self.ignore_case_inp = QCheckBox(checked=defaults.ignore_case)
+        self.basename_only_inp = QCheckBox(checked=defaults.basename_only)
+        self.use_index_inp = QCheckBox(checked=defaults.use_index)
+        self.content_inp = QCheckBox(checked=defaults.content)
+        self.first_match_only_inp = QCheckBox(checked=defaults.first_match_only)
+        self.stats_path_inp = QLineEdit(placeholderText="JSON Lines file, optional")
+        self.index_max_age_inp = QSpinBox(
+            minimum=1,
+            maximum=7 * 24 * 60,
+            value=int(defaults.index_max_age // 60),
+            suffix=" min",
+        )
+        self.model = ResultsModel(self)
+        # only the visible rows are laid out, all of them have the same height
+        self.results = QListView(uniformItemSizes=True)
+        self.results.setModel(self.model)
+        options = QFormLayout()
+        options.addRow("Search In", self.roots_inp)
+        options.addRow("Match", self.match_mode_inp)
+        options.addRow("Ignore Case", self.ignore_case_inp)
+        options.addRow("Match Names Only", self.basename_only_inp)
+        options.addRow("Search As You Type", self.as_you_type_inp)
+        options.addRow("Exclude", self.excludes_inp)
+        options.addRow("Max Depth", self.max_depth_inp)
+        options.addRow("Search File Contents", self.content_inp)
+        options.addRow("Only List Matching Files", self.first_match_only_inp)
+        options.addRow("Use Index", self.use_index_inp)
+        options.addRow("Index Stale After", self.index_max_age_inp)
+        options.addRow("Log Search Stats To", self.stats_path_inp)
         layout = QVBoxLayout()
         layout.addWidget(self.search_term_inp)
+        layout.addLayout(options)
         layout.addWidget(self.results)
         self.setLayout(layout)
-        self.returnPressed.connect(self.results.clear)
+        # a search starts once typing pauses, not on every keystroke
+        self.typing_timer = QTimer(self, singleShot=True)
+        self.typing_timer.setInterval(TYPING_DELAY)
+        self.typing_timer.timeout.connect(self.termTyped)
+        self.textChanged.connect(self.on_text_changed)
 
-    def addResult(self, result):
-        self.results.addItem(result)
+    def on_text_changed(self):
+        if self.as_you_type_inp.isChecked():
+            self.typing_timer.start()
+
+    def addResults(self, results: list[str]):
+        self.model.append(results)
 
 
 class MainWindow(QMainWindow):
+
+    search_requested: SIGNAL = pyqtSignal(int, str, bool)  # id, term, refine
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
@@ -89,8 +836,9 @@ class MainWindow(QMainWindow):
         # create search form
         # ------------------
 
-        form = SearchForm()
+        form = self.form = SearchForm()
         self.setCentralWidget(form)
+        self.search_id = 0  # of the search whose matches are shown
 
         # --------------------------------
         # create and start a worker thread
@@ -99,30 +847,87 @@ class MainWindow(QMainWindow):
         self.ss = SlowSearcher()
         self.searcher_thread = QThread()
         self.ss.moveToThread(self.searcher_thread)
-        self.ss.finished.connect(self.searcher_thread.quit)
         self.searcher_thread.start()
 
         # ----------------------------------------------
         # connect front-end (form) and back-end (worker)
         # ----------------------------------------------
 
-        form.textChanged.connect(self.ss.set_term)
-        form.returnPressed.connect(self.ss.do_search)
-        form.returnPressed.connect(self.searcher_thread.start)
-        self.ss.match_found.connect(form.addResult)
+        form.roots_inp.textChanged.connect(self.ss.set_roots)
+        form.match_mode_inp.currentTextChanged.connect(self.ss.set_match_mode)
+        form.ignore_case_inp.toggled.connect(self.ss.set_ignore_case)
+        form.basename_only_inp.toggled.connect(self.ss.set_basename_only)
+        form.excludes_inp.textChanged.connect(self.ss.set_excludes)
+        form.max_depth_inp.valueChanged.connect(self.ss.set_max_depth)
+        form.content_inp.toggled.connect(self.ss.set_content)
+        form.first_match_only_inp.toggled.connect(self.ss.set_first_match_only)
+        form.use_index_inp.toggled.connect(self.ss.set_use_index)
+        form.index_max_age_inp.valueChanged.connect(self.ss.set_index_max_age)
+        form.stats_path_inp.textChanged.connect(self.ss.set_stats_path)
+        form.returnPressed.connect(lambda: self.start_search(refine=False))
+        form.termTyped.connect(lambda: self.start_search(refine=True))
+        self.search_requested.connect(self.ss.do_search)
+        self.ss.matches_found.connect(self.on_matches_found)
         self.ss.finished.connect(self.on_finished)
         self.ss.dir_changed.connect(self.on_directory_changed)
+        self.ss.index_stale.connect(self.on_index_stale)
+        self.ss.pattern_error.connect(self.on_pattern_error)
+        self.search_status = QLabel()
+        self.statusBar().addPermanentWidget(self.search_status)
+        self.ss.stats_changed.connect(
+            lambda stats: self.search_status.setText(str(stats))
+        )
+
+        # ------------------------------------------------
+        # keep the index current from a thread of its own
+        # ------------------------------------------------
+
+        self.watcher = IndexWatcher()
+        self.watcher_thread = QThread()
+        self.watcher.moveToThread(self.watcher_thread)
+        self.watcher_thread.start()
+        self.ss.index_ready.connect(self.watcher.watch)
+        self.watch_status = QLabel()
+        self.statusBar().addPermanentWidget(self.watch_status)
+        self.watcher.stats_changed.connect(
+            lambda stats: self.watch_status.setText(str(stats))
+        )
 
-    def on_finished(self):
-        QMessageBox.information(self, "Complete", "Search complete")
+    def start_search(self, refine: bool):
+        """Cancel the running search and queue a new one for the current term. An
+        empty term only clears the results while typing."""
+        self.search_id += 1
+        self.ss.cancel(self.search_id)
+        self.form.model.clear()
+        term = self.form.search_term_inp.text()
+        if refine and not term:
+            self.statusBar().clearMessage()
+            return
+        self.search_requested.emit(self.search_id, term, refine)
+
+    def on_matches_found(self, search_id, matches):
+        if search_id == self.search_id:
+            self.form.addResults(matches)
+
+    def on_finished(self, search_id):
+        if search_id == self.search_id:
+            count = self.form.model.rowCount()
+            self.statusBar().showMessage(f"Search complete: {count} matches")
+
+    def on_pattern_error(self, search_id, message):
+        if search_id == self.search_id:
+            self.statusBar().showMessage(f"Invalid pattern: {message}")
 
     def on_directory_changed(self, path):
         self.statusBar().showMessage(f"Searching in: {path}")
 
+    def on_index_stale(self, age):
+        self.statusBar().showMessage(
+            f"Stale results: the index is {age / 60:.0f} minutes old, refreshing"
+        )
 
-if __name__ == "__main__":
-    import sys
 
+if __name__ == "__main__":
     app = QApplication(sys.argv)
     mw = MainWindow(windowTitle="SlowSearcher")
     mw.show()
@@ -0,0 +1,1625 @@
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import stat
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import (
+    Any,
+    BinaryIO,
+    Hashable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+    Callable,
+)
+from PyQt6.QtCore import (
+    QCryptographicHash,
+    QObject,
+    QRunnable,
+    QThreadPool,
+    pyqtBoundSignal,
+    pyqtSignal,
+    pyqtSlot,
+)
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+SIGNAL = Union[pyqtSignal, pyqtBoundSignal]
+SLOT = Union[Callable[..., None], pyqtBoundSignal]
+STAT_KEY = Tuple[int, int, int]  # size, mtime_ns, inode
+
+
+class QtDigest:
+    """`QCryptographicHash` with the `update()` / `hexdigest()` interface of hashlib."""
+
+    def __init__(self, algorithm: QCryptographicHash.Algorithm) -> None:
+        self.hash = QCryptographicHash(algorithm)
+
+    def update(self, data) -> None:
+        self.hash.addData(data)
+
+    def hexdigest(self) -> str:
+        return bytes(self.hash.result().toHex()).decode("utf-8")
+
+
+# ----------------------------------------------------------
+# hash algorithms by name, optional ones only when installed
+# ----------------------------------------------------------
+ALGORITHMS: dict[str, Callable[[], Any]] = {
+    "md5": partial(QtDigest, QCryptographicHash.Algorithm.Md5),
+    "sha1": partial(QtDigest, QCryptographicHash.Algorithm.Sha1),
+    "sha256": partial(QtDigest, QCryptographicHash.Algorithm.Sha256),
+    "sha512": partial(QtDigest, QCryptographicHash.Algorithm.Sha512),
+    "sha3-256": partial(QtDigest, QCryptographicHash.Algorithm.Sha3_256),
+    "blake2b": hashlib.blake2b,
+}
+if blake3:
+    ALGORITHMS["blake3"] = blake3.blake3
+if xxhash:
+    ALGORITHMS["xxh64"] = xxhash.xxh64
+    ALGORITHMS["xxh3-128"] = xxhash.xxh3_128
+
+
+class MultiDigest:
+    """Computes the digests of several algorithms in a single pass over the data.
+
+    `hexdigest()` joins the individual digests with tabs, in the order in which the
+    algorithms were given."""
+
+    def __init__(self, algorithms: Tuple[str, ...]) -> None:
+        self.digests = [ALGORITHMS[name]() for name in algorithms]
+
+    def update(self, data) -> None:
+        for digest in self.digests:
+            digest.update(data)
+
+    def hexdigest(self) -> str:
+        return "\t".join(digest.hexdigest() for digest in self.digests)
+
+
+@dataclass
+class HashOptions:
+    """Settings shared by the `HashManager` and all of its `HashRunner`s."""
+
+    mode: str = "hash"  # or "dedup" or "verify", see `MODES`
+    threads: int = 2  # worker threads, or worker processes with that backend
+    backend: str = "threads"  # or "processes", see `BACKENDS`
+    process_batch_size: int = 64  # files per task for the "processes" backend
+    size_scheduling: bool = True  # largest files first, small files packed together
+    schedule_window: int = 10_000  # files looked at when picking the largest
+    pack_bytes: int = 4 * 1024 * 1024  # files smaller than this are packed together
+    tree_hash: bool = False  # hash segments of large files in parallel, changes
+    # their digests to a tree hash, see `combine_tree`
+    segment_size: int = 256 * 1024 * 1024  # split files larger than this
+    algorithms: Tuple[str, ...] = ("md5",)  # one digest column per algorithm
+    recursive: bool = False  # also hash the files in all subdirectories
+    use_cache: bool = False  # only rehash files whose size, mtime or inode changed
+    resume: bool = False  # skip files an interrupted run already wrote out
+    chunk_size: int = 1024 * 1024  # bytes per read, 0 reads whole files at once
+    mmap_threshold: int = 64 * 1024 * 1024  # map files this large, 0 never maps
+    batch_size: int = 1000  # results buffered before they are written out
+    flush_interval: float = 1.0  # seconds before a partial batch is written anyway
+    progress_interval: float = 0.1  # minimum seconds between progress signals
+    adaptive_threads: bool = False  # find the thread count with the best throughput
+    adapt_interval: float = 2.0  # seconds of throughput measured per thread count
+    max_bytes_per_second: int = 0  # read no faster than this, 0 for no limit
+    output_format: str = "tsv"  # or "jsonl" or "sum", see `OUTPUT_FORMATS`
+    verbose: bool = True  # report every file as it is hashed
+    partial_size: int = 64 * 1024  # dedup compares this much of both ends first
+
+
+@dataclass
+class HashStats:
+    """Summary of a run, emitted with `HashManager.finished`."""
+
+    hashed: int = 0
+    cached: int = 0
+    failed: int = 0
+    skipped: int = 0  # already written by an earlier run that is being resumed
+    cache_lookups: int = 0
+    cancelled: bool = False
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached / self.cache_lookups if self.cache_lookups else 0.0
+
+    def __str__(self) -> str:
+        summary = f"{self.hashed} hashed, {self.cached} cached, {self.failed} failed"
+        if self.skipped:
+            summary += f", {self.skipped} skipped"
+        if self.cache_lookups:
+            summary += f", cache hit rate {self.cache_hit_rate:.1%}"
+        if self.cancelled:
+            summary += " (cancelled)"
+        return summary
+
+
+@dataclass
+class VerifyStats(HashStats):
+    """Summary of checking the files against a manifest."""
+
+    ok: int = 0
+    mismatched: int = 0
+    missing: int = 0  # in the manifest, but not found
+    new: int = 0  # found, but not in the manifest
+
+    def __str__(self) -> str:
+        summary = (
+            f"{self.ok} ok, {self.mismatched} mismatched, {self.missing} missing, "
+            f"{self.new} new, {self.failed} failed"
+        )
+        if self.cancelled:
+            summary += " (cancelled)"
+        return summary
+
+
+class VerifyIssue(NamedTuple):
+    """A file that does not match the manifest, emitted with `HashManager.mismatch`."""
+
+    kind: str  # "mismatch", "missing" or "new"
+    path: str
+    expected: Optional[str] = None  # hex digest from the manifest
+    actual: Optional[str] = None  # hex digest of the file
+
+
+@dataclass
+class DedupStats:
+    """Summary of a duplicate search, emitted with `HashManager.finished`."""
+
+    files: int = 0
+    bytes_found: int = 0
+    unique_size: int = 0  # ruled out by their size alone
+    partial_hashed: int = 0  # files compared by their first and last bytes
+    full_hashed: int = 0
+    bytes_read: int = 0
+    groups: int = 0
+    duplicates: int = 0  # files in a group beyond the first one
+    wasted_bytes: int = 0  # taken up by the duplicates
+    failed: int = 0
+    cancelled: bool = False
+
+    def __str__(self) -> str:
+        read = self.bytes_read / self.bytes_found if self.bytes_found else 0.0
+        summary = (
+            f"{self.duplicates} duplicates in {self.groups} groups, "
+            f"{self.wasted_bytes / 1e6:.0f} MB wasted, {self.files} files: "
+            f"{self.unique_size} unique size, {self.partial_hashed} partially and "
+            f"{self.full_hashed} fully hashed, {read:.1%} of the bytes read, "
+            f"{self.failed} failed"
+        )
+        if self.cancelled:
+            summary += " (cancelled)"
+        return summary
+
+
+@dataclass
+class HashProgress:
+    """Snapshot of a running job, emitted with `HashManager.progress`."""
+
+    files_done: int
+    bytes_done: int
+    files_found: int
+    bytes_found: int  # 0 if the walker does not stat the files
+    walking: bool  # the totals found so far are still growing
+    rate: float  # bytes per second, smoothed
+    eta: Optional[float]  # seconds, known once the walk is over
+    utilization: list[float]  # fraction of time each worker spent hashing
+    workers: int = 0  # threads the adaptive controller allows, 0 if it is off
+
+    def __str__(self) -> str:
+        found = f"{self.files_found}{'+' if self.walking else ''}"
+        summary = (
+            f"{self.files_done}/{found} files, {self.bytes_done / 1e6:.0f} MB, "
+            f"{self.rate / 1e6:.1f} MB/s"
+        )
+        if self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            summary += f", ETA {minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+        if self.utilization:
+            busy = sum(self.utilization) / len(self.utilization)
+            summary += f", workers {busy:.0%} busy"
+        if self.workers:
+            summary += f", {self.workers} readers"
+        return summary
+
+
+class HashCache:
+    """Digests from earlier runs, stored in an SQLite database next to the destination.
+
+    An entry is only reused while size, mtime and inode of the file are unchanged.
+    New digests are committed in batches of `commit_every`."""
+
+    commit_every = 1000
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, "
+            "size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT)"
+        )
+        self.uncommitted: list[tuple] = []
+
+    def __enter__(self) -> "HashCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def path_for(destination: str, options: HashOptions) -> str:
+        digest_name = "+".join(options.algorithms)
+        if options.tree_hash:
+            digest_name += f".tree{options.segment_size}"
+        return f"{destination}.{digest_name}.cache.sqlite"
+
+    def lookup(self, path: str, key: STAT_KEY) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT digest FROM digests WHERE path = ? "
+            "AND size = ? AND mtime_ns = ? AND inode = ?",
+            (path, *key),
+        ).fetchone()
+        return row[0] if row else None
+
+    def store(self, path: str, key: STAT_KEY, digest: str) -> None:
+        self.uncommitted.append((path, *key, digest))
+        if len(self.uncommitted) >= self.commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)",
+                self.uncommitted,
+            )
+        self.uncommitted.clear()
+
+    def close(self) -> None:
+        self.commit()
+        self.db.close()
+
+
+# ----------------------------------------------------------
+# output formats of the destination file, one line per file
+# ----------------------------------------------------------
+OUTPUT_FORMATS = ("tsv", "jsonl", "sum")
+
+
+def format_line(path: str, digest: str, options: HashOptions) -> str:
+    """One line of the destination file. `digest` holds one tab separated column per
+    algorithm, as returned by `MultiDigest.hexdigest()`.
+
+    "sum" is the format of sha256sum and friends, which escape backslashes and
+    newlines in the path and mark such lines with a leading backslash."""
+    if options.output_format == "jsonl":
+        record = {"path": path, **dict(zip(options.algorithms, digest.split("\t")))}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+    if options.output_format == "sum":
+        escaped = path.replace("\\", "\\\\").replace("\n", "\\n")
+        prefix = "\\" if escaped != path else ""
+        return f"{prefix}{digest}  {escaped}\n"
+    return f"{path}\t{digest}\n"
+
+
+def format_group(paths: list[str], digest: str, size: int, options: HashOptions) -> str:
+    """The lines for a group of identical files found in dedup mode. JSON Lines gets
+    one record per group, the other formats one line per file of the group."""
+    if options.output_format == "jsonl":
+        digests = dict(zip(options.algorithms, digest.split("\t")))
+        record = {"size": size, **digests, "paths": paths}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+    return "".join(format_line(path, digest, options) for path in paths)
+
+
+def parse_line(line: str, options: HashOptions) -> Tuple[str, str]:
+    """Path and digest of a line written by `format_line`. Raises ValueError, or
+    KeyError for a JSON record without the digest of one of `options.algorithms`."""
+    if options.output_format == "jsonl":
+        record = json.loads(line)
+        digest = "\t".join(record[name] for name in options.algorithms)
+        return record["path"], digest
+    line = line.rstrip("\n")
+    if options.output_format == "sum":
+        digest, path = line.split("  ", 1)
+        if digest.startswith("\\"):
+            digest = digest[1:]
+            unescape = {"\\\\": "\\", "\\n": "\n"}
+            path = re.sub(r"\\[\\n]", lambda match: unescape[match[0]], path)
+        return path, digest
+    path, digest = line.split("\t", 1)
+    return path, digest
+
+
+class ResultWriter:
+    """Buffers results and appends them to the destination file in batches.
+
+    Only the `HashManager` thread writes, so the file needs no lock and is opened
+    exactly once per run."""
+
+    def __init__(self, outfile: str, options: HashOptions) -> None:
+        self.options = options
+        self.batch_size = max(options.batch_size, 1)
+        self.flush_interval = options.flush_interval
+        self.batch: list[str] = []
+        self.out = open(outfile, "a", encoding="utf-8")
+        self.last_flush = time.monotonic()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, path: str, digest: str) -> None:
+        self.batch.append(format_line(path, digest, self.options))
+        if len(self.batch) >= self.batch_size or not self.time_to_flush():
+            self.flush()
+
+    def write_group(self, paths: list[str], digest: str, size: int) -> None:
+        self.batch.append(format_group(paths, digest, size, self.options))
+        if len(self.batch) >= self.batch_size or not self.time_to_flush():
+            self.flush()
+
+    def time_to_flush(self) -> float:
+        """Seconds left until a partial batch should be written."""
+        return max(self.last_flush + self.flush_interval - time.monotonic(), 0.0)
+
+    def wait_timeout(self) -> Optional[float]:
+        """How long the caller may block before a flush is due. With nothing buffered
+        there is no reason to wake up at all, which is signalled with None."""
+        return self.time_to_flush() if self.batch else None
+
+    def flush_if_due(self) -> None:
+        if not self.time_to_flush():
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batch:
+            self.out.writelines(self.batch)
+            self.out.flush()
+            self.batch.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self.out.close()
+
+
+def read_finished(destination: str, options: HashOptions) -> set[str]:
+    """The paths that an earlier, interrupted run already wrote to `destination`.
+
+    The destination doubles as the checkpoint journal of a run: results are appended
+    in batches and only once they are complete. A line torn by a crash is cut off, so
+    the file can be appended to again. Lines that cannot be parsed, e.g. of another
+    output format, are reported and skipped, their files are hashed again."""
+    finished = set()
+    try:
+        with open(destination, "r+b") as fh:
+            complete = 0
+            for number, line in enumerate(fh, 1):
+                if not line.endswith(b"\n"):
+                    break
+                complete += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    finished.add(parse_line(line.decode("utf-8"), options)[0])
+                except (ValueError, KeyError, TypeError) as error:
+                    message = f"{destination}:{number}: skipped, {error!r}"
+                    print(message, file=sys.stderr)
+            fh.truncate(complete)
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+def digest_key(digest: str) -> bytes:
+    """The binary form of a tab separated hex digest, half the size as a string."""
+    return bytes.fromhex(digest.replace("\t", ""))
+
+
+def read_manifest(manifest: str, options: HashOptions) -> dict[str, bytes]:
+    """Expected digests by path, from a file written in `options.output_format`.
+    Lines that cannot be parsed are reported and skipped."""
+    expected = {}
+    with open(manifest, encoding="utf-8") as fh:
+        for number, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                path, digest = parse_line(line, options)
+                expected[path] = digest_key(digest)
+            except (ValueError, KeyError, TypeError) as error:
+                print(f"{manifest}:{number}: skipped, {error!r}", file=sys.stderr)
+    return expected
+
+
+class ManifestChecker:
+    """Compares digests against a manifest. It takes the place of the `ResultWriter`
+    in a `VerifyJob`.
+
+    Entries are moved out of `expected` when their file is found, so what is left
+    after the walk is missing. Memory stays proportional to the manifest."""
+
+    def __init__(
+        self,
+        expected: dict[str, bytes],
+        stats: VerifyStats,
+        report: Callable[[VerifyIssue], None],
+    ) -> None:
+        self.expected = expected
+        self.stats = stats
+        self.report = report
+        self.pending: dict[str, bytes] = {}  # files being hashed
+
+    def claim(self, path: str) -> bool:
+        """Look up a file that was found. Returns False if it is not in the manifest,
+        which is reported right away."""
+        digest = self.expected.pop(path, None)
+        if digest is None:
+            self.stats.new += 1
+            self.report(VerifyIssue("new", path))
+            return False
+        self.pending[path] = digest
+        return True
+
+    def write(self, path: str, digest: str) -> None:
+        expected = self.pending.pop(path)
+        actual = digest_key(digest)
+        if actual == expected:
+            self.stats.ok += 1
+            return
+        self.stats.mismatched += 1
+        self.report(VerifyIssue("mismatch", path, expected.hex(), actual.hex()))
+
+    def report_missing(self) -> None:
+        for path, digest in self.expected.items():
+            self.stats.missing += 1
+            self.report(VerifyIssue("missing", path, digest.hex()))
+        self.expected.clear()
+
+    def wait_timeout(self) -> Optional[float]:
+        return None  # nothing is buffered
+
+    def flush_if_due(self) -> None:
+        pass
+
+
+def walk_files(root: str, recursive: bool) -> Iterator[str]:
+    """Yield the path of every file in `root`, and below it if `recursive` is set.
+
+    Directories are visited from an explicit stack instead of by recursion, so deep
+    trees cannot hit the recursion limit, and `os.scandir` provides the file type
+    without an extra `stat` call on most platforms."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as error:
+            print(f"could not scan {directory}: {error}", file=sys.stderr)
+
+
+def stat_key(path: str) -> Optional[STAT_KEY]:
+    """The part of a file's `stat` result that tells whether it changed."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_size, info.st_mtime_ns, info.st_ino
+
+
+class FileWalker(threading.Thread):
+    """Producer thread for `walk_files`.
+
+    Discovered files are put on the bounded `paths` queue as `(path, key)` tuples, so
+    the walk can never run more than `queue_size` files ahead of the hashing. `key`
+    is the `stat_key` of the file if `with_stat` is set, else None. `None` marks the
+    end of the walk."""
+
+    queue_size = 10_000
+
+    def __init__(self, root: str, recursive: bool, with_stat: bool = False) -> None:
+        super().__init__(name="FileWalker", daemon=True)
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.with_stat = with_stat
+        self.paths: queue.Queue = queue.Queue(self.queue_size)
+        self.stopped = threading.Event()
+        # only written by the walker thread, others may read them for progress
+        self.files_found = 0
+        self.bytes_found = 0
+
+    def run(self) -> None:
+        try:
+            for path in walk_files(self.root, self.recursive):
+                if self.stopped.is_set():
+                    return
+                key = stat_key(path) if self.with_stat else None
+                self.files_found += 1
+                self.bytes_found += key[0] if key else 0
+                self._put((path, key))
+        finally:
+            self._put(None)
+
+    def stop(self) -> None:
+        """End the walk early, even if nobody takes from the queue any more."""
+        self.stopped.set()
+
+    def _put(self, item: Optional[Tuple[str, Optional[STAT_KEY]]]) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.paths.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Part of a large file that is hashed on its own in tree-hash mode."""
+
+    path: str
+    index: int
+    offset: int
+    length: int
+
+
+TASK = Union[str, Segment]  # a whole file or one segment of it
+
+
+class HashResult(NamedTuple):
+    """What a `HashRunner` reports back for each task."""
+
+    task: TASK
+    digest: Optional[str]  # None if the file could not be read
+    worker: Hashable  # identifies the thread or process that did the work
+    seconds: float  # time spent on the task
+    size: int  # bytes hashed
+    cancelled: bool = False  # the job was cancelled before the task was done
+
+
+class HashCancelled(Exception):
+    """Raised inside a `HashRunner` when its job is cancelled between two chunks."""
+
+
+class TokenBucket:
+    """Limits the bytes per second read by all runners that share it.
+
+    Every chunk is paid for after it was read. A runner that leaves the bucket in
+    debt sleeps until the debt is paid off at `rate`, so bursts stay within one
+    second's worth of data."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int, cancelled: threading.Event) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate)
+            self.last = now
+            self.tokens -= amount
+            debt = -self.tokens
+        if debt > 0:
+            cancelled.wait(debt / self.rate)
+
+
+def create_limiter(bytes_per_second: float) -> Optional[TokenBucket]:
+    return TokenBucket(bytes_per_second) if bytes_per_second > 0 else None
+
+
+class ReadCounter:
+    """Counts the bytes read by all runners that share it, chunk by chunk.
+
+    A single file on a slow disk can take longer than a tuning interval, so the
+    bytes of finished files alone would show the `ThroughputTuner` empty intervals
+    followed by spikes."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount: int) -> None:
+        with self.lock:
+            self.total += amount
+
+
+# set in every worker process of the `ProcessBackend` by `init_worker`
+worker_cancelled: Optional[threading.Event] = None
+worker_limiter: Optional[TokenBucket] = None
+
+
+def init_worker(cancelled: threading.Event, bytes_per_second: float) -> None:
+    global worker_cancelled, worker_limiter
+    worker_cancelled = cancelled
+    worker_limiter = create_limiter(bytes_per_second)
+
+
+def split_file(path: str, size: int, segment_size: int) -> list[Segment]:
+    return [
+        Segment(path, index, offset, min(segment_size, size - offset))
+        for index, offset in enumerate(range(0, size, segment_size))
+    ]
+
+
+def combine_tree(digests: list[str], algorithms: Tuple[str, ...]) -> str:
+    """Combine the digests of all segments of a file into the digest of the file.
+
+    For every algorithm this is the hash over the concatenated binary digests of the
+    segments, in order. A file of a single segment keeps its plain digest."""
+    if len(digests) == 1:
+        return digests[0]
+    columns = zip(*(digest.split("\t") for digest in digests))
+    combined = []
+    for name, column in zip(algorithms, columns):
+        top = ALGORITHMS[name]()
+        top.update(b"".join(bytes.fromhex(leaf) for leaf in column))
+        combined.append(top.hexdigest())
+    return "\t".join(combined)
+
+
+class SizeScheduler:
+    """Reorders the files coming from a `FileWalker` so the largest go first.
+
+    Up to `window` files are held back in a heap, and the largest of them is handed
+    out next. A huge file that is found late then no longer keeps a single worker busy
+    long after all others have run dry. Mimics the `get` methods of the walker queue.
+    """
+
+    def __init__(self, paths: queue.Queue, window: int) -> None:
+        self.paths = paths
+        self.window = max(window, 1)
+        self.heap: list[tuple] = []
+        self.order = itertools.count()  # keeps files of the same size in walk order
+        self.walking = True
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        while self.walking and len(self.heap) < self.window:
+            try:
+                item = self.paths.get(block and not self.heap, timeout)
+            except queue.Empty:
+                if not self.heap:
+                    raise
+                break
+            if item is None:
+                self.walking = False
+                break
+            size = item[1][0] if item[1] else 0
+            heapq.heappush(self.heap, (-size, next(self.order), item))
+        if self.heap:
+            return heapq.heappop(self.heap)[2]
+        return None
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+
+def hash_batch(tasks: list[TASK], options: HashOptions) -> list[HashResult]:
+    """Hash several files in a worker process of the `ProcessBackend`."""
+    results: queue.SimpleQueue = queue.SimpleQueue()
+    for task in tasks:
+        HashRunner(task, results, options, worker_cancelled, worker_limiter).run()
+    return [results.get_nowait() for _ in tasks]
+
+
+class PackRunner(QRunnable):
+    """Hashes a pack of small files one after the other in a single runnable."""
+
+    def __init__(
+        self,
+        tasks: list[TASK],
+        results: queue.SimpleQueue,
+        options: HashOptions,
+        cancelled: threading.Event,
+        limiter: Optional[TokenBucket] = None,
+        counter: Optional[ReadCounter] = None,
+    ) -> None:
+        super().__init__()
+        self.tasks = tasks
+        self.results = results
+        self.options = options
+        self.cancelled = cancelled
+        self.limiter = limiter
+        self.counter = counter
+        self.setAutoDelete(True)
+
+    def run(self) -> None:
+        for task in self.tasks:
+            if self.cancelled.is_set():
+                return
+            runner = HashRunner(
+                task,
+                self.results,
+                self.options,
+                self.cancelled,
+                self.limiter,
+                self.counter,
+            )
+            runner.setAutoDelete(False)
+            runner.run()
+
+
+class ThroughputTuner:
+    """Hill-climbs the number of worker threads towards the highest throughput.
+
+    On spinning disks and network mounts concurrent readers compete for the same
+    head or link, and past some point more threads read less. Every `interval` the
+    throughput is compared with that of the previous thread count: one more step is
+    taken in a direction that paid off, the direction is reversed if it did not.
+    Without a clear difference fewer threads are preferred, as they are easier on
+    the disk."""
+
+    tolerance = 0.05  # changes in throughput smaller than this count as noise
+
+    def __init__(self, maximum: int, interval: float) -> None:
+        self.maximum = maximum
+        self.interval = interval
+        self.workers = 1  # start gently, the disk may be seeking already
+        self.direction = 1
+        self.last_rate = 0.0
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def update(self, bytes_read: int) -> Optional[int]:
+        """Feed in the total bytes read so far. Returns the new number of workers
+        once an interval is over, None while it is still running."""
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.interval:
+            return None
+        rate = (bytes_read - self.window_bytes) / elapsed
+        self.window_start = now
+        self.window_bytes = bytes_read
+        if not rate:
+            return None  # nothing was read, e.g. while waiting for the walk
+        if rate < self.last_rate * (1 - self.tolerance):
+            self.direction = -self.direction
+        elif rate <= self.last_rate * (1 + self.tolerance):
+            self.direction = -1
+        self.last_rate = rate
+        workers = min(max(self.workers + self.direction, 1), self.maximum)
+        if workers == self.workers:
+            self.direction = -self.direction  # at a limit, probe the other way
+        self.workers = workers
+        return workers
+
+
+class ThreadBackend:
+    """Hashes files in `HashRunner`s on the Qt thread pool.
+
+    Files smaller than `options.pack_bytes` are packed into a `PackRunner`, up to
+    `pack_files` of them, so tiny files do not pay the cost of a runnable each.
+    With `options.adaptive_threads` a `ThroughputTuner` sets the size of the pool,
+    up to `options.threads`, from the bytes the runners count in a shared
+    `ReadCounter`. All runners share one `TokenBucket` if the read rate is limited.
+    """
+
+    pending_per_thread = 4  # runnables queued in the pool per worker thread
+    pack_files = 256
+
+    def __init__(
+        self, pool: QThreadPool, options: HashOptions, results: queue.SimpleQueue
+    ) -> None:
+        self.pool = pool
+        self.options = options
+        self.results = results
+        self.capacity = options.threads * self.pending_per_thread * self.pack_files
+        self.pack: list[TASK] = []
+        self.pack_bytes = 0
+        self.cancelled = threading.Event()
+        self.limiter = create_limiter(options.max_bytes_per_second)
+        self.tuner = self.counter = None
+        if options.adaptive_threads:
+            self.tuner = ThroughputTuner(options.threads, options.adapt_interval)
+            self.counter = ReadCounter()
+        self.pool.setMaxThreadCount(self.workers)
+
+    @property
+    def workers(self) -> int:
+        return self.tuner.workers if self.tuner else self.options.threads
+
+    def adapt(self) -> None:
+        """Let the tuner resize the pool. Running runners finish their task first."""
+        if self.tuner and self.tuner.update(self.counter.total):
+            self.pool.setMaxThreadCount(self.tuner.workers)
+
+    def submit(self, task: TASK, size: int) -> None:
+        """Hash `task`. A `size` below 0 means that it is unknown."""
+        if not 0 <= size < self.options.pack_bytes:
+            runner = HashRunner(
+                task,
+                self.results,
+                self.options,
+                self.cancelled,
+                self.limiter,
+                self.counter,
+            )
+            self.pool.start(runner)
+            return
+        self.pack.append(task)
+        self.pack_bytes += size
+        if self.pack_bytes >= self.options.pack_bytes:
+            self.flush()
+        elif len(self.pack) >= self.pack_files:
+            self.flush()
+
+    def flush(self) -> None:
+        """Start a partially filled pack."""
+        if self.pack:
+            runner = PackRunner(
+                self.pack,
+                self.results,
+                self.options,
+                self.cancelled,
+                self.limiter,
+                self.counter,
+            )
+            self.pool.start(runner)
+            self.pack = []
+            self.pack_bytes = 0
+
+    def cancel(self) -> None:
+        """Drop the queued runners and make the running ones stop after their
+        current chunk. Not every submitted task will report back."""
+        self.cancelled.set()
+        self.pack = []
+        self.pool.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.pool.waitForDone()
+
+
+class ProcessBackend:
+    """Hashes files in worker processes, which do not share a GIL.
+
+    Files are sent in batches of `options.process_batch_size`, or of about
+    `options.pack_bytes` for larger files, to spread the cost of pickling and IPC over
+    many files. The results of a batch are put on `results` when it completes,
+    exactly like the `HashRunner`s of the `ThreadBackend` do.
+
+    The executor cannot be resized, so `options.adaptive_threads` has no effect here.
+    A read limit is split evenly between the processes."""
+
+    batches_per_worker = 2  # batches queued in the executor per worker process
+
+    def __init__(self, options: HashOptions, results: queue.SimpleQueue) -> None:
+        self.options = options
+        self.results = results
+        self.capacity = (
+            options.threads * options.process_batch_size * self.batches_per_worker
+        )
+        self.batch: list[TASK] = []
+        self.batch_bytes = 0
+        # forking a process that runs Qt threads is not safe, start fresh ones
+        context = multiprocessing.get_context("spawn")
+        self.cancelled = context.Event()
+        self.executor = ProcessPoolExecutor(
+            options.threads,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(self.cancelled, options.max_bytes_per_second / options.threads),
+        )
+        self.workers = options.threads
+
+    def adapt(self) -> None:
+        pass
+
+    def submit(self, task: TASK, size: int) -> None:
+        """Hash `task`. A `size` below 0 means that it is unknown."""
+        self.batch.append(task)
+        self.batch_bytes += max(size, 0)
+        if self.batch_bytes >= self.options.pack_bytes:
+            self.flush()
+        elif len(self.batch) >= self.options.process_batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send off a partially filled batch."""
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.batch_bytes = 0
+        future = self.executor.submit(hash_batch, batch, self.options)
+        future.add_done_callback(partial(self._on_batch_done, batch))
+
+    def _on_batch_done(self, batch: list[TASK], future: Future) -> None:
+        try:
+            results = future.result()
+        except Exception as error:  # e.g. a worker process died
+            print(
+                f"could not hash a batch of {len(batch)} files: {error}",
+                file=sys.stderr,
+            )
+            results = [HashResult(task, None, None, 0.0, 0) for task in batch]
+        for result in results:
+            self.results.put(result)
+
+    def cancel(self) -> None:
+        """Drop the queued batches and make the running ones stop after their
+        current chunk. Not every submitted task will report back."""
+        self.cancelled.set()
+        self.batch = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        self.flush()
+        self.executor.shutdown()
+
+
+BACKENDS = ("threads", "processes")
+MODES = ("hash", "dedup", "verify")
+
+
+class HashManager(QObject):
+    """Receives a list of files to be hashed from the `HashForm` and hands each file
+    to a backend, which hashes it in a `HashRunner`. The results come back through a
+    queue, which the manager drains into a `ResultWriter`."""
+
+    finished: SIGNAL = pyqtSignal(object)  # HashStats, or DedupStats in dedup mode
+    progress: SIGNAL = pyqtSignal(object)  # HashProgress
+    duplicates: SIGNAL = pyqtSignal(object)  # list of paths with identical content
+    mismatch: SIGNAL = pyqtSignal(object)  # VerifyIssue
+
+    poll_interval = 0.01  # seconds between looking for new files while the pool idles
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pool = QThreadPool.globalInstance()
+        self.cancel_requested = threading.Event()
+
+    def cancel(self) -> None:
+        """Stop the running job. Files that are already hashed are still written out,
+        so the job can be resumed later.
+
+        `do_hashing` keeps the manager's thread busy, so this must be called directly
+        from another thread instead of through a queued connection."""
+        self.cancel_requested.set()
+
+    @pyqtSlot(str, str, object)
+    def do_hashing(self, source: str, destination: str, options: HashOptions):
+        self.cancel_requested.clear()
+        if options.mode == "dedup":
+            self.find_duplicates(source, destination, options)
+            return
+        if options.mode == "verify":
+            self.verify(source, destination, options)
+            return
+        finished = set()
+        if options.resume:
+            finished = read_finished(destination, options)
+        stats = HashStats()
+        cache = None
+        if options.use_cache:
+            cache = HashCache(HashCache.path_for(destination, options))
+        with ResultWriter(destination, options) as writer:
+            try:
+                job = partial(HashJob, writer=writer, cache=cache, finished=finished)
+                self._run_job(source, options, stats, job)
+            finally:
+                if cache:
+                    cache.close()
+        if options.verbose:
+            print(f"finished: {stats}", file=sys.stderr)
+        self.finished.emit(stats)
+
+    def verify(self, source: str, manifest: str, options: HashOptions):
+        """Rehash the files in `source` and compare them with the digests in the
+        `manifest`, which must have been written with the same options. Mismatches,
+        new files and, after the walk, missing files are emitted as they are found."""
+        stats = VerifyStats()
+        try:
+            expected = read_manifest(manifest, options)
+        except (OSError, UnicodeDecodeError) as error:
+            print(f"cannot read manifest: {error}", file=sys.stderr)
+            stats.failed += 1
+            self.finished.emit(stats)
+            return
+        checker = ManifestChecker(expected, stats, self.mismatch.emit)
+        job = partial(VerifyJob, writer=checker, cache=None, finished=set())
+        self._run_job(source, options, stats, job)
+        if not stats.cancelled:
+            checker.report_missing()
+        if options.verbose:
+            print(f"finished: {stats}", file=sys.stderr)
+        self.finished.emit(stats)
+
+    def _run_job(
+        self,
+        source: str,
+        options: HashOptions,
+        stats: HashStats,
+        job_type: Callable[..., "HashJob"],
+    ) -> None:
+        """Walk `source` and hash every file found in a job of `job_type`."""
+        results: queue.SimpleQueue = queue.SimpleQueue()
+        backend = self._create_backend(options, results)
+        with_stat = options.use_cache or options.size_scheduling or options.tree_hash
+        walker = FileWalker(source, options.recursive, with_stat)
+        walker.start()
+        paths: Union[queue.Queue, SizeScheduler] = walker.paths
+        if options.size_scheduling:
+            paths = SizeScheduler(walker.paths, options.schedule_window)
+        job = job_type(backend=backend, stats=stats, options=options, walker=walker)
+        try:
+            self._dispatch(paths, results, job)
+        finally:
+            walker.stop()
+            backend.close()
+            # keep what was completed while a cancelled job wound down
+            while not results.empty():
+                job.collect(results.get_nowait())
+        walker.join()
+
+    def _create_backend(
+        self, options: HashOptions, results: queue.SimpleQueue
+    ) -> Union[ThreadBackend, ProcessBackend]:
+        if options.backend == "processes":
+            return ProcessBackend(options, results)
+        return ThreadBackend(self.pool, options, results)
+
+    def find_duplicates(self, source: str, destination: str, options: HashOptions):
+        """Write out groups of files with identical content, reading as little of the
+        files as possible.
+
+        Only files of the same size can be identical, all others are ruled out after
+        the walk. Of the rest, the first and last `options.partial_size` bytes are
+        hashed, and only the files that still collide after that are hashed in full.
+        Files no larger than both ends together are hashed in full right away."""
+        stats = DedupStats()
+        by_size: dict[int, list[str]] = defaultdict(list)
+        for path in walk_files(os.path.abspath(source), options.recursive):
+            if self.cancel_requested.is_set():
+                stats.cancelled = True
+                break
+            key = stat_key(path)
+            if key is None:
+                stats.failed += 1
+                continue
+            stats.files += 1
+            stats.bytes_found += key[0]
+            by_size[key[0]].append(path)
+        candidates = {size: paths for size, paths in by_size.items() if len(paths) > 1}
+        stats.unique_size = stats.files - sum(map(len, candidates.values()))
+        del by_size
+
+        head = options.partial_size
+        identical: dict[tuple[int, str], list[str]] = {}
+        results: queue.SimpleQueue = queue.SimpleQueue()
+        backend = self._create_backend(options, results)
+        try:
+            # -----------------------------------------------
+            # stage 2: hash both ends, small files completely
+            # -----------------------------------------------
+            tasks: list[tuple[TASK, int]] = []
+            for size, paths in candidates.items():
+                for path in paths:
+                    if size <= 2 * head:
+                        tasks.append((path, size))
+                    else:
+                        tasks.append((Segment(path, 0, 0, head), head))
+                        tasks.append((Segment(path, 1, size - head, head), head))
+            digests = self._hash_tasks(tasks, backend, results, stats)
+            colliding: dict[tuple[int, str], list[str]] = defaultdict(list)
+            if stats.cancelled:
+                candidates = {}  # the partial digests are incomplete
+            for size, paths in candidates.items():
+                for path in paths:
+                    if size <= 2 * head:
+                        parts = [digests.get(path)]
+                        stats.full_hashed += 1
+                    else:
+                        parts = [
+                            digests.get(Segment(path, 0, 0, head)),
+                            digests.get(Segment(path, 1, size - head, head)),
+                        ]
+                        stats.partial_hashed += 1
+                    if None in parts:
+                        stats.failed += 1
+                        continue
+                    colliding[(size, "\n".join(parts))].append(path)
+            for (size, digest), paths in colliding.items():
+                if size <= 2 * head and len(paths) > 1:
+                    identical[(size, digest)] = paths
+
+            # ----------------------------------------------------
+            # stage 3: hash the larger files that collided so far
+            # ----------------------------------------------------
+            tasks = [
+                (path, size)
+                for (size, _), paths in colliding.items()
+                if size > 2 * head and len(paths) > 1
+                for path in paths
+            ]
+            tasks.sort(key=lambda task: task[1], reverse=True)
+            digests = self._hash_tasks(tasks, backend, results, stats)
+            if not stats.cancelled:
+                full: dict[tuple[int, str], list[str]] = defaultdict(list)
+                for path, size in tasks:
+                    stats.full_hashed += 1
+                    if path not in digests:
+                        stats.failed += 1
+                        continue
+                    full[(size, digests[path])].append(path)
+                identical.update(
+                    (group, paths) for group, paths in full.items() if len(paths) > 1
+                )
+        finally:
+            backend.close()
+
+        # report what is confirmed, even if the search was cancelled
+        groups = sorted(identical.items(), key=lambda group: group[0][0], reverse=True)
+        with ResultWriter(destination, options) as writer:
+            for (size, digest), paths in groups:
+                stats.groups += 1
+                stats.duplicates += len(paths) - 1
+                stats.wasted_bytes += size * (len(paths) - 1)
+                writer.write_group(paths, digest, size)
+                self.duplicates.emit(paths)
+        if options.verbose:
+            print(f"finished: {stats}", file=sys.stderr)
+        self.finished.emit(stats)
+
+    def _hash_tasks(
+        self,
+        tasks: list[tuple[TASK, int]],
+        backend: Union[ThreadBackend, ProcessBackend],
+        results: queue.SimpleQueue,
+        stats: DedupStats,
+    ) -> dict[TASK, str]:
+        """Hash all `(task, size)` pairs and return the digests of those that did not
+        fail. Stops early, with `stats.cancelled` set, when the job is cancelled."""
+        digests: dict[TASK, str] = {}
+        if stats.cancelled:
+            return digests
+        todo = iter(tasks)
+        in_flight = submitted = 0
+        files_done = bytes_done = 0
+        bytes_total = sum(size for _, size in tasks)
+        interval = backend.options.progress_interval
+        start = last_report = time.monotonic()
+        while True:
+            if self.cancel_requested.is_set():
+                stats.cancelled = True
+                backend.cancel()
+                break
+            for task, size in itertools.islice(todo, backend.capacity - in_flight):
+                backend.submit(task, size)
+                in_flight += 1
+                submitted += 1
+            if submitted == len(tasks):
+                # a partial batch is only sent off when nothing will join it
+                backend.flush()
+            if not in_flight:
+                break
+            backend.adapt()
+            now = time.monotonic()
+            if now - last_report >= interval:
+                rate = bytes_done / max(now - start, 1e-6)
+                eta = (bytes_total - bytes_done) / rate if rate else None
+                self.progress.emit(
+                    HashProgress(
+                        files_done,
+                        bytes_done,
+                        len(tasks),
+                        bytes_total,
+                        False,
+                        rate,
+                        eta,
+                        [],
+                        backend.workers if backend.options.adaptive_threads else 0,
+                    )
+                )
+                last_report = now
+            try:
+                result = results.get(timeout=interval)
+            except queue.Empty:
+                backend.flush()
+                continue
+            in_flight -= 1
+            files_done += 1
+            bytes_done += result.size
+            stats.bytes_read += result.size
+            if result.digest is not None:
+                digests[result.task] = result.digest
+        return digests
+
+    def _dispatch(
+        self,
+        paths: Union[queue.Queue, SizeScheduler],
+        results: queue.SimpleQueue,
+        job: "HashJob",
+    ) -> None:
+        """Submit every path coming from the walker to the backend and write the
+        results until the walk is over and every file has been reported back.
+
+        Hashing starts with the first file found. Only about `backend.capacity` tasks
+        are in flight at any time, so memory stays bounded however many files the walk
+        turns up."""
+        backend = job.backend
+        writer = job.writer
+        walking = True
+        while walking or job.keys:
+            if self.cancel_requested.is_set():
+                job.stats.cancelled = True
+                backend.cancel()
+                break
+            if not job.time_to_progress():
+                self.progress.emit(job.progress())
+            backend.adapt()
+
+            # leave the loop when a report is due, even if every file is cached
+            while (
+                walking
+                and len(job.keys) < backend.capacity
+                and job.time_to_progress()
+            ):
+                try:
+                    if job.keys:
+                        item = paths.get_nowait()
+                    else:
+                        item = paths.get(timeout=job.wait_timeout())
+                except queue.Empty:
+                    backend.flush()
+                    break
+                if item is None:
+                    walking = False
+                    backend.flush()
+                    break
+                job.submit(*item)
+            if not job.keys:
+                writer.flush_if_due()
+                continue
+
+            timeout = job.wait_timeout()
+            if walking and len(job.keys) < backend.capacity:
+                # the pool has room, look for new files again soon
+                timeout = min(timeout, self.poll_interval)
+            try:
+                result = results.get(timeout=timeout)
+            except queue.Empty:
+                writer.flush_if_due()
+                continue
+            job.collect(result)
+        self.progress.emit(job.progress())
+
+
+class HashJob:
+    """Bookkeeping of one run of the `HashManager`: which tasks are in flight, the
+    segments of split files collected so far, where finished digests go and how fast
+    that happens."""
+
+    rate_smoothing = 0.3  # weight of the latest interval in the reported rate
+
+    def __init__(
+        self,
+        backend: Union[ThreadBackend, ProcessBackend],
+        writer: Union[ResultWriter, ManifestChecker],
+        cache: Optional[HashCache],
+        stats: HashStats,
+        options: HashOptions,
+        walker: FileWalker,
+        finished: set[str],
+    ) -> None:
+        self.backend = backend
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.options = options
+        self.walker = walker
+        self.finished = finished  # paths to skip when resuming
+        self.keys: dict[TASK, Optional[STAT_KEY]] = {}  # of the tasks in flight
+        self.segments: dict[str, list[Optional[str]]] = {}
+        self.segments_left: dict[str, int] = {}
+
+        # ------------------
+        # progress reporting
+        # ------------------
+        self.files_done = 0
+        self.bytes_done = 0
+        self.bytes_hashed = 0
+        self.busy: dict[Hashable, float] = {}  # seconds per worker since last report
+        self.rate = 0.0
+        self.last_report = time.monotonic()
+        self.last_bytes_hashed = 0
+
+    def time_to_progress(self) -> float:
+        """Seconds left until the next progress report is due."""
+        due = self.last_report + self.options.progress_interval
+        return max(due - time.monotonic(), 0.0)
+
+    def wait_timeout(self) -> float:
+        """How long the manager may block before a flush or progress report is due."""
+        timeout = self.time_to_progress()
+        flush_timeout = self.writer.wait_timeout()
+        if flush_timeout is not None:
+            timeout = min(timeout, flush_timeout)
+        return timeout
+
+    def progress(self) -> HashProgress:
+        """Sum up the progress since the last report and start a new interval."""
+        now = time.monotonic()
+        elapsed = max(now - self.last_report, 1e-6)
+        latest = (self.bytes_hashed - self.last_bytes_hashed) / elapsed
+        self.rate += self.rate_smoothing * (latest - self.rate)
+        # a task is accounted for when it finishes, so long ones can overshoot
+        utilization = [min(seconds / elapsed, 1.0) for seconds in self.busy.values()]
+        utilization.sort(reverse=True)
+        utilization = utilization[: self.options.threads]
+        utilization += [0.0] * (self.options.threads - len(utilization))
+        self.busy.clear()
+        self.last_report = now
+        self.last_bytes_hashed = self.bytes_hashed
+
+        walking = self.walker.is_alive()
+        files_found = self.walker.files_found
+        bytes_found = self.walker.bytes_found
+        eta = None
+        if not walking and self.rate > 0:
+            if bytes_found:
+                eta = max(bytes_found - self.bytes_done, 0) / self.rate
+            elif self.files_done:
+                bytes_per_file = self.bytes_done / self.files_done
+                eta = (files_found - self.files_done) * bytes_per_file / self.rate
+        return HashProgress(
+            self.files_done,
+            self.bytes_done,
+            files_found,
+            bytes_found,
+            walking,
+            self.rate,
+            eta,
+            utilization,
+            self.backend.workers if self.options.adaptive_threads else 0,
+        )
+
+    def submit(self, path: str, key: Optional[STAT_KEY]) -> None:
+        """Hand a file to the backend, unless the cache already knows its digest."""
+        if path in self.finished:
+            self.stats.skipped += 1
+            self.files_done += 1
+            return
+        if self.cache and key:
+            self.stats.cache_lookups += 1
+            digest = self.cache.lookup(path, key)
+            if digest:
+                self.stats.cached += 1
+                self.files_done += 1
+                self.bytes_done += key[0]
+                self.writer.write(path, digest)
+                return
+        size = key[0] if key else -1
+        if self.options.tree_hash and size > self.options.segment_size:
+            segments = split_file(path, size, self.options.segment_size)
+            self.segments[path] = [None] * len(segments)
+            self.segments_left[path] = len(segments)
+            for segment in segments:
+                self.keys[segment] = key
+                self.backend.submit(segment, segment.length)
+        else:
+            self.keys[path] = key
+            self.backend.submit(path, size)
+
+    def collect(self, result: HashResult) -> None:
+        """Take the result of a task. Segments are held until the file is complete."""
+        task, digest = result.task, result.digest
+        key = self.keys.pop(task, None)
+        if result.cancelled:
+            return
+        self.bytes_done += result.size
+        self.bytes_hashed += result.size
+        if result.worker is not None:
+            busy = self.busy.get(result.worker, 0.0)
+            self.busy[result.worker] = busy + result.seconds
+        if isinstance(task, Segment):
+            path = task.path
+            self.segments[path][task.index] = digest
+            self.segments_left[path] -= 1
+            if self.segments_left[path]:
+                return
+            del self.segments_left[path]
+            digests = self.segments.pop(path)
+            if None in digests:
+                digest = None
+            else:
+                digest = combine_tree(digests, self.options.algorithms)
+        else:
+            path = task
+        self.files_done += 1
+        if digest is None:
+            self.stats.failed += 1
+            return
+        self.stats.hashed += 1
+        self.writer.write(path, digest)
+        if self.cache and key:
+            self.cache.store(path, key, digest)
+
+
+class VerifyJob(HashJob):
+    """A `HashJob` that hands its digests to a `ManifestChecker` and does not hash
+    files that are not in the manifest at all."""
+
+    writer: ManifestChecker
+
+    def submit(self, path: str, key: Optional[STAT_KEY]) -> None:
+        if not self.writer.claim(path):
+            self.files_done += 1
+            return
+        super().submit(path, key)
+
+
+class HashRunner(QRunnable):
+    """Worker thread for hashing a file, or a `Segment` of it, with all algorithms in
+    `options.algorithms`.
+
+    The outcome is put on the `results` queue as a `HashResult`."""
+
+    def __init__(
+        self,
+        task: TASK,
+        results: queue.SimpleQueue,
+        options: HashOptions,
+        cancelled: Optional[threading.Event] = None,
+        limiter: Optional[TokenBucket] = None,
+        counter: Optional[ReadCounter] = None,
+    ) -> None:
+        super().__init__()
+        self.task = task
+        if isinstance(task, Segment):
+            self.infile = task.path
+            self.offset, self.length = task.offset, task.length
+        else:
+            self.infile = task
+            self.offset, self.length = 0, -1
+        self.results = results
+        self.options = options
+        self.cancelled = cancelled or threading.Event()
+        self.limiter = limiter
+        self.counter = counter
+        self.size = 0
+        self.setAutoDelete(True)
+
+    def run(self) -> None:
+        """This is our main method. It is called by `QThreadPool.start()`."""
+        if self.options.verbose:
+            print(f"hashing {self.infile}...", file=sys.stderr)
+        start = time.perf_counter()
+        hash_string: Optional[str] = None
+        cancelled = False
+        try:
+            hash_string = self.hash_file()
+        except HashCancelled:
+            cancelled = True
+        except OSError as error:
+            print(f"could not hash {self.infile}: {error}", file=sys.stderr)
+        finally:
+            # always report back, the manager counts the results it is waiting for
+            worker = (os.getpid(), threading.get_ident())
+            seconds = time.perf_counter() - start
+            self.results.put(
+                HashResult(
+                    self.task, hash_string, worker, seconds, self.size, cancelled
+                )
+            )
+
+    def hash_file(self) -> str:
+        """Hash `length` bytes from `offset`, or everything with a `length` of -1."""
+        self.hasher = MultiDigest(self.options.algorithms)
+        with open(self.infile, "rb", buffering=0) as fh:
+            if not self._hash_mapped(fh):
+                fh.seek(self.offset)
+                if self.options.chunk_size > 0:
+                    self._hash_chunked(fh)
+                else:
+                    data = fh.read(self.length)
+                    self.size = len(data)
+                    self.hasher.update(data)
+                    self._account(len(data))
+        return self.hasher.hexdigest()
+
+    def _hash_mapped(self, fh: BinaryIO) -> bool:
+        """Hash the file through a read-only memory map, if it is suitable for that.
+
+        Slices of the map are handed to the hasher as `memoryview`s, so the data is
+        never copied into Python objects. Returns False without touching the hasher
+        for small files, pipes and special files, or if the file cannot be mapped.
+        """
+        threshold = self.options.mmap_threshold
+        info = os.fstat(fh.fileno())
+        if threshold <= 0 or not stat.S_ISREG(info.st_mode):
+            return False
+        size = info.st_size - self.offset
+        if self.length >= 0:
+            size = min(size, self.length)
+        if size < threshold:
+            return False
+        try:
+            mapped = mmap.mmap(
+                fh.fileno(), size, access=mmap.ACCESS_READ, offset=self.offset
+            )
+        except (OSError, ValueError):
+            return False
+
+        with mapped, memoryview(mapped) as view:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            step = self.options.chunk_size or len(view)
+            for offset in range(0, len(view), step):
+                if self.cancelled.is_set():
+                    raise HashCancelled
+                with view[offset : offset + step] as piece:
+                    self.hasher.update(piece)
+                    self._account(len(piece))
+        self.size = size
+
+        # a sweep over large files should not push everything else out of the cache
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fh.fileno(), self.offset, size, os.POSIX_FADV_DONTNEED)
+        return True
+
+    def _hash_chunked(self, fh: BinaryIO) -> None:
+        """Feed the file to the hasher `chunk_size` bytes at a time, up to `length`.
+
+        A single buffer is allocated per runner and refilled with `readinto()`, so the
+        memory used does not depend on the size of the file."""
+        buffer = memoryview(bytearray(self.options.chunk_size))
+        remaining = self.length
+        while remaining:
+            if self.cancelled.is_set():
+                raise HashCancelled
+            if 0 < remaining < len(buffer):
+                length = fh.readinto(buffer[:remaining])
+            else:
+                length = fh.readinto(buffer)
+            if not length:
+                break
+            self.hasher.update(buffer[:length])
+            self._account(length)
+            self.size += length
+            if remaining > 0:
+                remaining -= length
+
+    def _account(self, length: int) -> None:
+        """Count `length` bytes just read and pay them to the limiter, which may sleep
+        to keep the rate."""
+        if self.counter:
+            self.counter.add(length)
+        if self.limiter:
+            self.limiter.consume(length, self.cancelled)
@@ -1,98 +1,46 @@
+import os
 from typing import Union, Callable
 from PyQt6.QtGui import QAction
 from PyQt6.QtCore import (
-    QCryptographicHash,
-    QDir,
-    QMutex,
-    QMutexLocker,
-    QObject,
-    QRunnable,
     QThread,
-    QThreadPool,
     Qt,
     pyqtBoundSignal,
     pyqtSignal,
-    pyqtSlot,
 )
 from PyQt6.QtWidgets import (
     QApplication,
+    QCheckBox,
+    QComboBox,
     QFileDialog,
     QFormLayout,
+    QListWidget,
+    QListWidgetItem,
     QMainWindow,
     QPushButton,
+    QDoubleSpinBox,
     QSpinBox,
     QWidget,
 )
+from hash_engine import (
+    ALGORITHMS,
+    BACKENDS,
+    MODES,
+    OUTPUT_FORMATS,
+    HashManager,
+    HashOptions,
+)
 
 
 SIGNAL = Union[pyqtSignal, pyqtBoundSignal]
 SLOT = Union[Callable[..., None], pyqtBoundSignal]
 
 
-class HashManager(QObject):
-    """Receives a list of files to be hashed from the `HashForm` and assigns each file
-    to a `HashRunner`."""
-
-    finished: SIGNAL = pyqtSignal()
-
-    def __init__(self) -> None:
-        super().__init__()
-        self.pool = QThreadPool.globalInstance()
-
-    @pyqtSlot(str, str, int)
-    def do_hashing(self, source: str, destination: str, threads: int):
-        self.pool.setMaxThreadCount(threads)
-        qdir = QDir(source)
-        for filename in qdir.entryList(QDir.Filter.Files):
-            filepath = qdir.absoluteFilePath(filename)
-            runner = HashRunner(filepath, destination)
-            self.pool.start(runner)
-        self.pool.waitForDone()
-        self.finished.emit()
-
-
-class HashRunner(QRunnable):
-    """Worker thread for hashing a file and writing the result to another file."""
-
-    file_lock = QMutex()
-
-    def __init__(self, infile: str, outfile: str) -> None:
-        super().__init__()
-        self.infile = infile
-        self.outfile = outfile
-        self.hasher = QCryptographicHash(QCryptographicHash.Algorithm.Md5)
-        self.setAutoDelete(True)
-
-    def run(self) -> None:
-        """This is our main method. It is called by `QThreadPool.start()`."""
-        print(f"hashing {self.infile}...")
-        self.hasher.reset()
-        with open(self.infile, "rb") as fh:
-            self.hasher.addData(fh.read())
-        hash_string = bytes(self.hasher.result().toHex()).decode("utf-8")
-
-        # ----------------------------------------
-        # traditional approach using try / finally
-        # ----------------------------------------
-        # try:
-        #     self.file_lock.lock()
-        #     with open(self.outfile, "a", encoding="utf-8") as out:
-        #         out.write(f"{self.infile}\t{hash_string}\n")
-        # finally:
-        #     self.file_lock.unlock()
-
-        # -----------------------------------------------
-        # alternative, using QMutexLocker context manager
-        # -----------------------------------------------
-        with QMutexLocker(self.file_lock):
-            with open(self.outfile, "a", encoding="utf-8") as out:
-                out.write(f"{self.infile}\t{hash_string}\n")
-
-
 class HashForm(QWidget):
     """Front end for selecting a directory and configuring settings of the hash runner."""
 
-    submitted: SIGNAL = pyqtSignal(str, str, int)
+    submitted: SIGNAL = pyqtSignal(str, str, object)
+    cancelled: SIGNAL = pyqtSignal()
+    rejected: SIGNAL = pyqtSignal(str)  # why the settings were not submitted
 
     def __init__(self):
         super().__init__()
@@ -106,8 +54,71 @@ class HashForm(QWidget):
         self.destination_file = QPushButton(
             "Click to select...", clicked=self.on_dest_click
         )
-        self.threads = QSpinBox(minimum=1, maximum=7, value=2)
+        defaults = HashOptions()
+        self.mode = QComboBox()
+        self.mode.addItems(MODES)
+        self.mode.setCurrentText(defaults.mode)
+        self.threads = QSpinBox(
+            minimum=1, maximum=max(os.cpu_count() or 1, 7), value=defaults.threads
+        )
+        self.adaptive_threads = QCheckBox(checked=defaults.adaptive_threads)
+        self.max_rate = QSpinBox(
+            minimum=0,
+            maximum=100_000,
+            value=defaults.max_bytes_per_second // 10**6,
+            singleStep=10,
+            suffix=" MB/s",
+            specialValueText="Unlimited",
+        )
+        self.backend = QComboBox()
+        self.backend.addItems(BACKENDS)
+        self.backend.setCurrentText(defaults.backend)
+        self.recursive = QCheckBox(checked=defaults.recursive)
+        self.size_scheduling = QCheckBox(checked=defaults.size_scheduling)
+        self.tree_hash = QCheckBox(checked=defaults.tree_hash)
+        self.segment_size = QSpinBox(
+            minimum=1,
+            maximum=64 * 1024,
+            value=defaults.segment_size // 2**20,
+            singleStep=64,
+            suffix=" MiB",
+        )
+        self.algorithms = QListWidget()
+        for name in ALGORITHMS:
+            item = QListWidgetItem(name, self.algorithms)
+            checked = name in defaults.algorithms
+            item.setCheckState(
+                Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked
+            )
+        self.output_format = QComboBox()
+        self.output_format.addItems(OUTPUT_FORMATS)
+        self.output_format.setCurrentText(defaults.output_format)
+        self.use_cache = QCheckBox(checked=defaults.use_cache)
+        self.resume = QCheckBox(checked=defaults.resume)
+        self.chunk_size = QSpinBox(
+            minimum=0,
+            maximum=64 * 1024,
+            value=defaults.chunk_size // 1024,
+            singleStep=256,
+            suffix=" KiB",
+            specialValueText="Whole file",
+        )
+        self.mmap_threshold = QSpinBox(
+            minimum=0,
+            maximum=1024 * 1024,
+            value=defaults.mmap_threshold // 2**20,
+            singleStep=64,
+            suffix=" MiB",
+            specialValueText="Never",
+        )
+        self.batch_size = QSpinBox(
+            minimum=1, maximum=1_000_000, value=defaults.batch_size, singleStep=100
+        )
+        self.flush_interval = QDoubleSpinBox(
+            minimum=0.0, maximum=60.0, value=defaults.flush_interval, suffix=" s"
+        )
         submit = QPushButton("Go", clicked=self.on_submit)
+        cancel = QPushButton("Cancel", clicked=self.cancelled)
 
         # ---------------
         # arrange layout:
@@ -115,8 +126,24 @@ class HashForm(QWidget):
         layout = QFormLayout()
         layout.addRow("Source Path", self.source_path)
         layout.addRow("Destination File", self.destination_file)
+        layout.addRow("Mode", self.mode)
         layout.addRow("Threads", self.threads)
-        layout.addRow(submit)
+        layout.addRow("Adapt Threads to Throughput", self.adaptive_threads)
+        layout.addRow("Read Limit", self.max_rate)
+        layout.addRow("Backend", self.backend)
+        layout.addRow("Largest Files First", self.size_scheduling)
+        layout.addRow("Tree Hash Large Files", self.tree_hash)
+        layout.addRow("Tree Hash Segment Size", self.segment_size)
+        layout.addRow("Include Subdirectories", self.recursive)
+        layout.addRow("Algorithms", self.algorithms)
+        layout.addRow("Output Format", self.output_format)
+        layout.addRow("Reuse Unchanged Digests", self.use_cache)
+        layout.addRow("Resume Previous Run", self.resume)
+        layout.addRow("Chunk Size", self.chunk_size)
+        layout.addRow("Memory-map Files From", self.mmap_threshold)
+        layout.addRow("Write Batch Size", self.batch_size)
+        layout.addRow("Flush Interval", self.flush_interval)
+        layout.addRow(submit, cancel)
         self.setLayout(layout)
 
     def on_source_click(self):
@@ -130,11 +157,43 @@ class HashForm(QWidget):
             self.destination_file.setText(filename)
 
     def on_submit(self):
-        self.submitted.emit(
-            self.source_path.text(),
-            self.destination_file.text(),
-            self.threads.value(),
+        algorithms = tuple(
+            self.algorithms.item(row).text()
+            for row in range(self.algorithms.count())
+            if self.algorithms.item(row).checkState() == Qt.CheckState.Checked
+        )
+        output_format = self.output_format.currentText()
+        if not algorithms:
+            self.rejected.emit("Select at least one algorithm.")
+            return
+        # a checksum file has room for exactly one digest per line
+        if output_format == "sum" and len(algorithms) > 1:
+            self.rejected.emit("The sum format takes exactly one algorithm.")
+            return
+        destination = self.destination_file.text()
+        if self.mode.currentText() == "verify" and not os.path.isfile(destination):
+            self.rejected.emit("Select the manifest to verify against.")
+            return
+        options = HashOptions(
+            mode=self.mode.currentText(),
+            threads=self.threads.value(),
+            adaptive_threads=self.adaptive_threads.isChecked(),
+            max_bytes_per_second=self.max_rate.value() * 10**6,
+            backend=self.backend.currentText(),
+            size_scheduling=self.size_scheduling.isChecked(),
+            tree_hash=self.tree_hash.isChecked(),
+            segment_size=self.segment_size.value() * 2**20,
+            algorithms=algorithms,
+            recursive=self.recursive.isChecked(),
+            use_cache=self.use_cache.isChecked(),
+            resume=self.resume.isChecked(),
+            chunk_size=self.chunk_size.value() * 1024,
+            mmap_threshold=self.mmap_threshold.value() * 2**20,
+            batch_size=self.batch_size.value(),
+            flush_interval=self.flush_interval.value(),
+            output_format=output_format,
         )
+        self.submitted.emit(self.source_path.text(), destination, options)
 
 
 class MainWindow(QMainWindow):
@@ -148,12 +207,30 @@ class MainWindow(QMainWindow):
         self.manager.moveToThread(self.manager_thread)
         self.manager_thread.start()
         form.submitted.connect(self.manager.do_hashing)
+        # the manager's thread is busy while hashing, so cancel from this one
+        form.cancelled.connect(
+            self.manager.cancel, type=Qt.ConnectionType.DirectConnection
+        )
+        form.rejected.connect(self.statusBar().showMessage)
         form.submitted.connect(
             lambda x, y, z: self.statusBar().showMessage(
-                f"Processing files in {x} into {y} with {z} threads."
+                f"Processing files in {x} into {y} with {z.threads} threads."
+            )
+        )
+        self.manager.progress.connect(
+            lambda progress: self.statusBar().showMessage(str(progress))
+        )
+        self.manager.duplicates.connect(
+            lambda paths: self.statusBar().showMessage(
+                f"{len(paths)} identical files: {', '.join(paths)}"
             )
         )
-        self.manager.finished.connect(lambda: self.statusBar().showMessage("Finished"))
+        self.manager.mismatch.connect(
+            lambda issue: self.statusBar().showMessage(f"{issue.kind}: {issue.path}")
+        )
+        self.manager.finished.connect(
+            lambda stats: self.statusBar().showMessage(f"Finished: {stats}")
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,324 @@
+"""Compare peak memory and throughput of the `HashRunner` read strategies and hash
+algorithms, or of whole hasher runs over synthetic directory trees.
+
+Every measurement runs in a fresh interpreter, so the peak RSS reported by the child
+belongs to exactly one configuration. Several algorithms joined with "+" are computed
+in a single pass:
+
+    python hasher_benchmark.py --size-mb 2048 --chunk-kib 64 1024
+    python hasher_benchmark.py --algorithms md5 sha256 md5+sha256
+
+With --suite, trees of many tiny files, a few huge files and a log-normal mix of
+sizes are generated from a fixed seed and hashed by hasher_cli.py with every
+combination of --threads and --algorithms. Files/s, MB/s, peak RSS and CPU use go to
+a JSON report, which a later run can be compared with:
+
+    python hasher_benchmark.py --suite --threads 1 4 --report before.json
+    python hasher_benchmark.py --suite --threads 1 4 --compare before.json
+
+The trees are hashed right after they were written, so this measures the hashing
+from the page cache rather than the disk.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def tiny_size(rng: random.Random) -> int:
+    return rng.randint(0, 4096)
+
+
+def huge_size(rng: random.Random) -> int:
+    return 256 * 2**20
+
+
+def lognormal_size(rng: random.Random) -> int:
+    """Median of 64 KiB with a long tail, capped at 1 GiB."""
+    return min(int(rng.lognormvariate(math.log(64 * 1024), 2.0)), 2**30)
+
+
+# ------------------------------------------------------
+# synthetic trees: number of files, size of a file each
+# ------------------------------------------------------
+TREES = {
+    "tiny": (20_000, tiny_size),
+    "huge": (4, huge_size),
+    "mixed": (2_000, lognormal_size),
+}
+FILES_PER_DIRECTORY = 500
+SEED = 10
+
+
+def make_sample(directory: str, size_mb: int) -> str:
+    """Write a file of `size_mb` MiB of random data and return its path."""
+    path = os.path.join(directory, "sample.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as fh:
+        for _ in range(size_mb):
+            fh.write(block)
+    return path
+
+
+def make_tree(directory: str, name: str, scale: float) -> dict:
+    """Write the synthetic tree `name` below `directory` and describe it.
+
+    The sizes come from a generator with a fixed seed, so every run hashes the same
+    tree. The content is a random block repeated, which is as good as fresh random
+    data to a hash function and much quicker to write."""
+    count, size_of = TREES[name]
+    count = max(int(count * scale), 1)
+    rng = random.Random(f"{SEED}-{name}")
+    block = rng.randbytes(1024 * 1024)
+    root = os.path.join(directory, name)
+    total = 0
+    for index in range(count):
+        subdirectory = os.path.join(root, f"{index // FILES_PER_DIRECTORY:04d}")
+        if not index % FILES_PER_DIRECTORY:
+            os.makedirs(subdirectory)
+        size = size_of(rng)
+        with open(os.path.join(subdirectory, f"{index:07d}.bin"), "wb") as fh:
+            for offset in range(0, size, len(block)):
+                fh.write(block[: size - offset])
+        total += size
+    return {"path": root, "files": count, "bytes": total}
+
+
+def run_hasher(
+    tree: dict, destination: str, threads: int, algorithm: str, backend: str
+) -> dict:
+    """Hash `tree` with hasher_cli.py in a child process and measure the run.
+
+    The resource usage of the child is collected with `os.wait4()`, so peak RSS and
+    CPU time belong to this one run, including any worker processes it waited for.
+    """
+    args = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "hasher_cli.py"),
+        tree["path"],
+        destination,
+        "--recursive",
+        "--threads",
+        str(threads),
+        "--backend",
+        backend,
+    ]
+    for name in algorithm.split("+"):
+        args += ["--algorithm", name]
+    start = time.perf_counter()
+    child = subprocess.Popen(
+        args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    _, status, usage = os.wait4(child.pid, 0)
+    elapsed = time.perf_counter() - start
+    # reaped behind the back of `child`, which would otherwise wait for it again
+    child.returncode = os.waitstatus_to_exitcode(status)
+    if child.returncode:
+        raise subprocess.CalledProcessError(child.returncode, args)
+    os.remove(destination)
+    peak_rss = usage.ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return {
+        "seconds": elapsed,
+        "files_per_second": tree["files"] / elapsed,
+        "mb_per_second": tree["bytes"] / elapsed / 1e6,
+        "peak_rss": peak_rss,
+        # busy cores on average, can exceed 1 with several threads or processes
+        "cpu_utilization": (usage.ru_utime + usage.ru_stime) / elapsed,
+    }
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    """Run every combination of tree, thread count and algorithm, keeping the
+    fastest of `args.repeat` runs of each."""
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": args.backend,
+        "scale": args.scale,
+        "results": [],
+    }
+    algorithms = args.algorithms or ["md5", "sha256"]
+    print(
+        f"{'tree':<8}{'threads':>8}  {'algorithm':<14}{'files/s':>10}{'MB/s':>10}"
+        f"{'peak RSS (MiB)':>16}{'CPU':>7}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        destination = os.path.join(tmp, "digests.tsv")
+        for name in args.trees:
+            tree = make_tree(tmp, name, args.scale)
+            for threads in args.threads:
+                for algorithm in algorithms:
+                    runs = [
+                        run_hasher(tree, destination, threads, algorithm, args.backend)
+                        for _ in range(args.repeat)
+                    ]
+                    best = min(runs, key=lambda run: run["seconds"])
+                    result = {
+                        "tree": name,
+                        "files": tree["files"],
+                        "bytes": tree["bytes"],
+                        "threads": threads,
+                        "algorithm": algorithm,
+                        **best,
+                    }
+                    report["results"].append(result)
+                    print(
+                        f"{name:<8}{threads:>8}  {algorithm:<14}"
+                        f"{best['files_per_second']:>10.0f}"
+                        f"{best['mb_per_second']:>10.1f}"
+                        f"{best['peak_rss'] / 2**20:>16.1f}"
+                        f"{best['cpu_utilization']:>7.2f}"
+                    )
+    return report
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Print the change in MB/s and files/s of every configuration in both reports.
+
+    Runs with another backend or scale are not comparable, so nothing is printed."""
+    for setting in ("backend", "scale"):
+        if report.get(setting) != baseline.get(setting):
+            print(
+                f"\nnot compared with {baseline['created']}: {setting} "
+                f"{baseline.get(setting)} there, {report.get(setting)} here",
+                file=sys.stderr,
+            )
+            return
+    before = {
+        (result["tree"], result["threads"], result["algorithm"]): result
+        for result in baseline["results"]
+    }
+    print(f"\ncompared with {baseline['created']}:")
+    print(f"{'tree':<8}{'threads':>8}  {'algorithm':<14}{'MB/s':>10}{'files/s':>10}")
+    for result in report["results"]:
+        old = before.get(
+            (result["tree"], result["threads"], result["algorithm"])
+        )
+        if not old:
+            continue
+        mb = result["mb_per_second"] / old["mb_per_second"] - 1
+        files = result["files_per_second"] / old["files_per_second"] - 1
+        print(
+            f"{result['tree']:<8}{result['threads']:>8}  {result['algorithm']:<14}"
+            f"{mb:>+10.1%}{files:>+10.1%}"
+        )
+
+
+def measure(path: str, chunk_size: int, mmap_threshold: int, algorithms: str) -> dict:
+    """Hash `path` once with a `HashRunner` and report time and peak RSS.
+
+    This is executed in the child process."""
+    import resource
+    from hash_engine import HashOptions, HashRunner
+
+    options = HashOptions(
+        algorithms=tuple(algorithms.split("+")),
+        chunk_size=chunk_size,
+        mmap_threshold=mmap_threshold,
+    )
+    runner = HashRunner(path, queue.SimpleQueue(), options)
+    runner.setAutoDelete(False)
+    start = time.perf_counter()
+    runner.run()
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux but in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return {"seconds": elapsed, "peak_rss": peak_rss}
+
+
+def run_child(
+    path: str, chunk_size: int, mmap_threshold: int, algorithms: str = "md5"
+) -> dict:
+    child_args = ["--child", path, str(chunk_size), str(mmap_threshold), algorithms]
+    output = subprocess.run(
+        [sys.executable, __file__, *child_args],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--chunk-kib", type=int, nargs="+", default=[64, 1024])
+    parser.add_argument(
+        "--algorithms",
+        nargs="+",
+        help="algorithms to compare, default: all available and md5+sha256",
+    )
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    suite = parser.add_argument_group("tree suite")
+    suite.add_argument("--suite", action="store_true", help="benchmark whole runs")
+    suite.add_argument("--trees", nargs="+", choices=TREES, default=list(TREES))
+    suite.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    suite.add_argument("--backend", choices=["threads", "processes"], default="threads")
+    suite.add_argument(
+        "--scale", type=float, default=1.0, help="multiplies the number of files"
+    )
+    suite.add_argument("--repeat", type=int, default=3, help="keep the fastest run")
+    suite.add_argument("--report", help="write the results to this JSON file")
+    suite.add_argument("--compare", help="JSON report of an earlier run")
+    args = parser.parse_args()
+
+    if args.suite:
+        report = run_suite(args)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as fh:
+                json.dump(report, fh, indent=2)
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as fh:
+                compare(report, json.load(fh))
+        return 0
+
+    if args.child:
+        path, chunk_size, mmap_threshold, algorithms = args.child
+        result = measure(path, int(chunk_size), int(mmap_threshold), algorithms)
+        print(json.dumps(result))
+        return 0
+
+    from hash_engine import ALGORITHMS
+
+    algorithms = args.algorithms or [*ALGORITHMS, "md5+sha256"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sample = make_sample(tmp, args.size_mb)
+        size = os.path.getsize(sample)
+        print(f"{'mode':<20}{'MB/s':>10}{'peak RSS (MiB)':>18}")
+        modes = [("whole file", 0, 0)]
+        for chunk_kib in args.chunk_kib:
+            modes.append((f"chunked {chunk_kib} KiB", chunk_kib * 1024, 0))
+            modes.append((f"mmap {chunk_kib} KiB", chunk_kib * 1024, 1))
+        for mode, chunk_size, mmap_threshold in modes:
+            result = run_child(sample, chunk_size, mmap_threshold)
+            throughput = size / result["seconds"] / 1e6
+            rss = result["peak_rss"] / 2**20
+            print(f"{mode:<20}{throughput:>10.1f}{rss:>18.1f}")
+
+        # the sample is in the page cache by now, so this measures the hashing only
+        print(f"\n{'algorithm':<20}{'MB/s':>10}")
+        for algorithm in algorithms:
+            result = run_child(sample, 1024 * 1024, 0, algorithm)
+            throughput = size / result["seconds"] / 1e6
+            print(f"{algorithm:<20}{throughput:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
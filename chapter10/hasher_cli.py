@@ -0,0 +1,148 @@
+"""Hash every file in a directory without a GUI, e.g. from cron on a server.
+
+Only QtCore is loaded, so no display is needed and start-up is quick. Digests are
+appended to the destination file; diagnostics go to stderr. In verify mode the
+destination is a manifest written earlier with the same options, and every file
+that does not match it is printed. The exit status is 1 if any file could not be
+hashed or verified and 130 if the run was interrupted:
+
+    python hasher_cli.py ~/data digests.tsv --threads 8 --recursive
+    python hasher_cli.py ~/data SHA256SUMS --algorithm sha256 --format sum
+    python hasher_cli.py ~/data digests.jsonl -a md5 -a blake2b --format jsonl
+    python hasher_cli.py ~/data duplicates.tsv --mode dedup --recursive
+    python hasher_cli.py ~/data digests.tsv --mode verify --recursive
+"""
+import argparse
+import os
+import signal
+import sys
+from typing import Union
+
+from PyQt6.QtCore import QCoreApplication
+
+from hash_engine import (
+    ALGORITHMS,
+    BACKENDS,
+    MODES,
+    OUTPUT_FORMATS,
+    DedupStats,
+    HashManager,
+    HashOptions,
+    HashStats,
+    VerifyIssue,
+    VerifyStats,
+)
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    defaults = HashOptions()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory with the files to hash")
+    parser.add_argument(
+        "destination", help="file the digests are appended to, or the manifest"
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=MODES,
+        default=defaults.mode,
+        help="hash every file, write groups of identical files only, or check the "
+        "files against the manifest",
+    )
+    parser.add_argument("-t", "--threads", type=int, default=defaults.threads)
+    parser.add_argument(
+        "-a",
+        "--algorithm",
+        action="append",
+        choices=ALGORITHMS,
+        help=f"repeat for one digest column each, default: {defaults.algorithms[0]}",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="tune the number of threads, up to --threads, for the best throughput",
+    )
+    parser.add_argument(
+        "--max-rate", type=float, default=0, help="read at most this many MB/s"
+    )
+    parser.add_argument("-r", "--recursive", action="store_true")
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=defaults.output_format,
+        help="tab separated, JSON Lines or sha256sum compatible",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default=defaults.backend)
+    parser.add_argument(
+        "--cache", action="store_true", help="only rehash files that changed"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="skip files already in destination"
+    )
+    parser.add_argument(
+        "--progress", action="store_true", help="report progress on stderr"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    args.algorithm = tuple(args.algorithm or defaults.algorithms)
+    if not os.path.isdir(args.source):
+        parser.error(f"{args.source} is not a directory")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if args.mode == "verify" and not os.path.isfile(args.destination):
+        parser.error(f"manifest {args.destination} does not exist")
+    if args.format == "sum" and len(args.algorithm) > 1:
+        parser.error("--format sum takes exactly one --algorithm")
+    return args
+
+
+def print_issue(issue: VerifyIssue) -> None:
+    print(f"{issue.kind.upper()}\t{issue.path}", flush=True)
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    options = HashOptions(
+        mode=args.mode,
+        threads=args.threads,
+        adaptive_threads=args.adaptive,
+        max_bytes_per_second=int(args.max_rate * 10**6),
+        backend=args.backend,
+        algorithms=args.algorithm,
+        recursive=args.recursive,
+        use_cache=args.cache,
+        resume=args.resume,
+        output_format=args.format,
+        verbose=args.verbose,
+    )
+
+    app = QCoreApplication(sys.argv[:1])
+    app.setApplicationName("hasher")
+    manager = HashManager()
+    outcome: list[Union[HashStats, DedupStats]] = []
+    manager.finished.connect(outcome.append)
+    manager.mismatch.connect(print_issue)
+    if args.progress:
+        manager.progress.connect(
+            lambda progress: print(f"\r{progress}", end="", file=sys.stderr)
+        )
+    # the manager checks for cancellation between waits, so a Python handler runs
+    # in time even though the hashing blocks this thread
+    signal.signal(signal.SIGINT, lambda signum, frame: manager.cancel())
+
+    manager.do_hashing(args.source, args.destination, options)
+    stats = outcome[0]
+    if args.progress:
+        print(file=sys.stderr)
+    print(f"{args.source}: {stats}", file=sys.stderr)
+    if stats.cancelled:
+        return 130
+    if isinstance(stats, VerifyStats) and (stats.mismatched or stats.missing):
+        return 1
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,404 @@
+import bisect
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional, Tuple, Union
+from PyQt6.QtCore import (
+    QFileSystemWatcher,
+    QObject,
+    QTimer,
+    pyqtBoundSignal,
+    pyqtSignal,
+    pyqtSlot,
+)
+
+SIGNAL = Union[pyqtSignal, pyqtBoundSignal]
+SLOT = Union[Callable[..., None], pyqtBoundSignal]
+
+
+def scan_directory(path: str) -> Optional[Tuple[int, list[str]]]:
+    """The mtime of a directory and the names of its entries, with a trailing "/"
+    for subdirectories. None if it cannot be listed.
+
+    The mtime is taken first, so a change during the listing shows up next time."""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            names = [
+                f"{entry.name}/" if entry.is_dir(follow_symlinks=False) else entry.name
+                for entry in entries
+            ]
+    except OSError:
+        return None
+    return mtime_ns, names
+
+
+def find_lines(blob: str, term: str) -> list[str]:
+    """The lines of `blob`, each ending in a newline, that contain `term`."""
+    if not term:
+        return blob.split("\n")[:-1]
+    lines = []
+    start = blob.find(term)
+    while start >= 0:
+        line_start = blob.rfind("\n", 0, start) + 1
+        line_end = blob.find("\n", start)
+        lines.append(blob[line_start:line_end])
+        start = blob.find(term, line_end)
+    return lines
+
+
+class FileIndex:
+    """Locate-style index of every name below `roots`, stored in an SQLite file.
+
+    Per directory the index keeps its mtime and the names of its entries. Creating,
+    deleting or renaming an entry changes the mtime of the directory it is in, so
+    `update` only rescans directories whose mtime moved. Searches run against `blob`,
+    the sorted paths joined by newlines, which `str.find` scans at memory speed.
+    Rescans patch the entries of their directories into the sorted `paths` the blob
+    is joined from, instead of sorting every path again."""
+
+    patch_limit = 256  # more changed paths than this are merged in a single pass
+
+    def __init__(self, path: str, roots: Tuple[str, ...]) -> None:
+        self.path = path
+        self.roots = roots
+        self.directories: dict[str, Tuple[int, list[str]]] = {}
+        self.updated = 0.0  # time of the last build or refresh
+        self.paths: list[str] = []
+        self.blob = ""
+        self.lock = threading.Lock()  # held while the index is updated
+
+    @staticmethod
+    def path_for(base: str, roots: Tuple[str, ...]) -> str:
+        """The index file of `roots`. Each set of roots gets a file of its own, so an
+        index that is still updated for other roots never writes into it."""
+        digest = hashlib.sha1(b"\0".join(os.fsencode(root) for root in roots))
+        stem, extension = os.path.splitext(base)
+        return f"{stem}.{digest.hexdigest()[:12]}{extension}"
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.directories)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.updated
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS directories "
+            "(path BLOB PRIMARY KEY, mtime_ns INTEGER, names BLOB)"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        return db
+
+    def load(self) -> None:
+        """Read the index file, if it was built for the same roots. An index of
+        other roots is deleted, the next update builds the file anew."""
+        with self.lock:
+            db = self._connect()
+            try:
+                meta = dict(db.execute("SELECT key, value FROM meta"))
+                if meta.get("roots") != "\0".join(self.roots):
+                    with db:
+                        db.execute("DELETE FROM directories")
+                        db.execute("DELETE FROM meta")
+                    return
+                for path, mtime_ns, names in db.execute("SELECT * FROM directories"):
+                    self.directories[os.fsdecode(path)] = (
+                        mtime_ns,
+                        [os.fsdecode(name) for name in names.split(b"\0") if name],
+                    )
+                self.updated = float(meta.get("updated", 0.0))
+            finally:
+                db.close()
+            self._patch_paths(set(), self._entries(self.directories))
+
+    def update(self) -> None:
+        """Build the index, or bring all of it up to date. Called from a background
+        thread."""
+        self.refresh(updated=time.time())
+
+    def refresh(
+        self,
+        directories: Optional[Iterable[str]] = None,
+        updated: Optional[float] = None,
+    ) -> Tuple[list[str], list[str]]:
+        """Rescan those of `directories`, all by default, whose mtime changed.
+
+        New subdirectories are scanned along with their parent, and the subtrees of
+        directories that are gone are dropped. If `updated` is given, the index
+        counts as current as of that time, even if nothing changed. Returns the
+        directories that were scanned and those that were removed."""
+        with self.lock:
+            changed: dict[str, Tuple[int, list[str]]] = {}
+            removed: set[str] = set()
+            if not self.directories:
+                for root in self.roots:
+                    self._scan_tree(root, changed)
+            if directories is None:
+                directories = list(self.directories)
+            for directory in directories:
+                if directory not in self.directories or directory in removed:
+                    continue
+                try:
+                    if os.stat(directory).st_mtime_ns == self.directories[directory][0]:
+                        continue
+                except OSError:
+                    removed.update(self._subtree(directory))
+                    continue
+                old_names = set(self.directories[directory][1])
+                if not self._scan_tree(directory, changed):
+                    removed.update(self._subtree(directory))
+                    continue
+                for name in old_names.difference(changed[directory][1]):
+                    if name.endswith("/"):
+                        gone = os.path.join(directory, name[:-1])
+                        removed.update(self._subtree(gone))
+            for directory in removed:
+                changed.pop(directory, None)
+            old = set(self._entries(removed.union(changed)))
+            for directory in removed:
+                self.directories.pop(directory, None)
+            self.directories.update(changed)
+            new = set(self._entries(changed))
+            if updated is not None:
+                self.updated = updated
+            if changed or removed:
+                self._patch_paths(old - new, new - old)
+            if changed or removed or updated is not None:
+                self._save(changed, removed)
+            return list(changed), list(removed)
+
+    def directory_list(self) -> list[str]:
+        """A snapshot of the indexed directories, safe to take during an update."""
+        with self.lock:
+            return list(self.directories)
+
+    def _subtree(self, top: str) -> list[str]:
+        prefix = os.path.join(top, "")
+        return [d for d in self.directories if d == top or d.startswith(prefix)]
+
+    def _scan_tree(self, top: str, changed: dict) -> bool:
+        """Scan `top` and every subdirectory that is not indexed yet into `changed`.
+        Returns False if `top` cannot be listed."""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            record = scan_directory(directory)
+            if record is None:
+                if directory == top:
+                    return False
+                continue
+            changed[directory] = record
+            for name in record[1]:
+                if name.endswith("/"):
+                    subdirectory = os.path.join(directory, name[:-1])
+                    if subdirectory not in self.directories:
+                        stack.append(subdirectory)
+        return True
+
+    def _entries(self, directories: Iterable[str]) -> list[str]:
+        """The paths of the indexed entries of `directories`."""
+        # a name with a newline in it could not be told apart, it is left out
+        return [
+            os.path.join(directory, name.rstrip("/"))
+            for directory in directories
+            if directory in self.directories
+            for name in self.directories[directory][1]
+            if "\n" not in name
+        ]
+
+    def _patch_paths(self, gone: set[str], added: Iterable[str]) -> None:
+        """Take `gone` out of the sorted `paths`, put `added` in, and join the blob."""
+        added = sorted(added)
+        if len(gone) + len(added) <= self.patch_limit:
+            for path in gone:
+                position = bisect.bisect_left(self.paths, path)
+                if position < len(self.paths) and self.paths[position] == path:
+                    del self.paths[position]
+            for path in added:
+                bisect.insort(self.paths, path)
+        else:
+            paths = [path for path in self.paths if path not in gone]
+            paths += added
+            paths.sort()  # two sorted runs, which are merged in linear time
+            self.paths = paths
+        self.blob = "\n".join(self.paths) + "\n" if self.paths else ""
+
+    def _save(self, changed: dict, removed: Iterable[str]) -> None:
+        db = self._connect()
+        try:
+            with db:
+                db.executemany(
+                    "DELETE FROM directories WHERE path = ?",
+                    [(os.fsencode(directory),) for directory in removed],
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                    [
+                        (
+                            os.fsencode(directory),
+                            mtime_ns,
+                            b"\0".join(os.fsencode(name) for name in names),
+                        )
+                        for directory, (mtime_ns, names) in changed.items()
+                    ],
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    [("roots", "\0".join(self.roots)), ("updated", self.updated)],
+                )
+        finally:
+            db.close()
+
+    def search(self, term: str) -> list[str]:
+        """All indexed paths that contain `term`, in sorted order."""
+        return find_lines(self.blob, term)  # an update swaps in a new blob
+
+
+class IndexUpdater(threading.Thread):
+    """Runs `FileIndex.update` in the background."""
+
+    def __init__(self, index: FileIndex) -> None:
+        super().__init__(name="IndexUpdater", daemon=True)
+        self.index = index
+
+    def run(self) -> None:
+        self.index.update()
+
+
+@dataclass
+class WatchStats:
+    """How an `IndexWatcher` keeps up, emitted with `IndexWatcher.stats_changed`."""
+
+    watched: int  # directories with a kernel watch, e.g. an inotify watch
+    polled: int  # directories whose mtime is checked every `poll_interval`
+    budget: int
+    failed: int  # watches the system refused, e.g. at its inotify limit
+    events: int  # change notifications since watching began
+    events_per_second: float
+
+    def __str__(self) -> str:
+        return (
+            f"{self.watched}/{self.budget} directories watched, {self.polled} polled, "
+            f"{self.events_per_second:.1f} events/s"
+        )
+
+
+class IndexWatcher(QObject):
+    """Keeps a `FileIndex` current from file system events.
+
+    Up to `budget` directories, the shallowest first, get a `QFileSystemWatcher`
+    watch, which is an inotify watch on Linux. Every event marks its directory as
+    dirty, and dirty directories are rescanned together once events have settled
+    for `settle_interval`, so a burst of events costs a single refresh. Directories
+    beyond the budget, or refused by the system, are polled for a changed mtime
+    every `poll_interval` instead."""
+
+    stats_changed: SIGNAL = pyqtSignal(object)  # WatchStats
+
+    settle_interval = 0.2
+    stats_interval = 1.0
+
+    def __init__(
+        self,
+        budget: int = 4096,
+        poll_interval: float = 30.0,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self.index: Optional[FileIndex] = None
+        self.watcher: Optional[QFileSystemWatcher] = None
+        self.dirty: set[str] = set()
+        self.failed = 0
+        self.events = 0
+        self.last_events = 0
+        self.last_stats = time.monotonic()
+
+    @pyqtSlot(object)
+    def watch(self, index: FileIndex) -> None:
+        """Start watching `index` instead of the one watched so far. Must run in
+        the thread the watcher lives in, the timers and watches are created here."""
+        if index is self.index:
+            return
+        self.stop()
+        self.index = index
+        self.dirty.clear()
+        self.failed = self.events = self.last_events = 0
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        self.settle_timer = QTimer(self, singleShot=True)
+        self.settle_timer.setInterval(int(self.settle_interval * 1000))
+        self.settle_timer.timeout.connect(self.apply_changes)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(int(self.poll_interval * 1000))
+        self.poll_timer.timeout.connect(self.poll)
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(int(self.stats_interval * 1000))
+        self.stats_timer.timeout.connect(self.report)
+        self._add_watches(index.directory_list())
+        self.poll_timer.start()
+        self.stats_timer.start()
+
+    @pyqtSlot()
+    def stop(self) -> None:
+        if self.watcher is None:
+            return
+        for timer in (self.settle_timer, self.poll_timer, self.stats_timer):
+            timer.stop()
+        self.watcher.deleteLater()
+        self.watcher = None
+        self.index = None
+
+    def on_directory_changed(self, path: str) -> None:
+        self.events += 1
+        self.dirty.add(path)
+        if not self.settle_timer.isActive():
+            self.settle_timer.start()
+
+    def apply_changes(self) -> None:
+        dirty, self.dirty = self.dirty, set()
+        self._refresh(dirty)
+
+    def poll(self) -> None:
+        """Check the directories without a watch. Afterwards everything in the index
+        was either watched or checked, so it counts as current."""
+        started = time.time()
+        watched = set(self.watcher.directories())
+        self._refresh(
+            (d for d in self.index.directory_list() if d not in watched), started
+        )
+
+    def _refresh(
+        self, directories: Iterable[str], updated: Optional[float] = None
+    ) -> None:
+        scanned, removed = self.index.refresh(directories, updated)
+        watched = set(self.watcher.directories())
+        gone = [directory for directory in removed if directory in watched]
+        if gone:
+            self.watcher.removePaths(gone)
+        self._add_watches([d for d in scanned if d not in watched])
+
+    def _add_watches(self, directories: list[str]) -> None:
+        room = self.budget - len(self.watcher.directories())
+        if room <= 0 or not directories:
+            return
+        directories.sort(key=lambda directory: directory.count(os.sep))
+        self.failed += len(self.watcher.addPaths(directories[:room]))
+
+    def report(self) -> None:
+        now = time.monotonic()
+        rate = (self.events - self.last_events) / max(now - self.last_stats, 1e-6)
+        self.last_events, self.last_stats = self.events, now
+        watched = len(self.watcher.directories())
+        polled = len(self.index.directories) - watched
+        self.stats_changed.emit(
+            WatchStats(watched, polled, self.budget, self.failed, self.events, rate)
+        )